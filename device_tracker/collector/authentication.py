@@ -0,0 +1,62 @@
+import time
+from threading import Lock
+
+from rest_framework.authentication import TokenAuthentication
+
+from collector.constants import TOKEN_CACHE_TTL, TOKEN_CACHE_MAX_ENTRIES
+
+
+class TokenCache:
+
+    def __init__(self, ttl=TOKEN_CACHE_TTL, max_entries=TOKEN_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, credentials = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            return credentials
+
+    def set(self, key, credentials):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (time.monotonic() + self.ttl, credentials)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key, (_, (user, _)) in list(self._entries.items()):
+                if user.pk == user_id:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+# Token authentication which resolves a token with its user once per ttl
+# instead of on every request, deleted tokens and changed users are dropped
+# from the cache by the signal receivers in `collector.signals`.
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        credentials = token_cache.get(key)
+        if credentials is None:
+            credentials = super().authenticate_credentials(key)
+            token_cache.set(key, credentials)
+        return credentials
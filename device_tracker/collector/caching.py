@@ -0,0 +1,50 @@
+import time
+from urllib.parse import quote
+
+from django.core.cache import cache
+from django.db import transaction
+
+from collector.constants import NETWORK_DEVICES_CACHE_TIMEOUT
+
+
+# Cached entries are keyed by a version which is bumped on every change
+# instead of deleting them, so an entry built before the change is never
+# read again and simply expires. Versions start from the current time,
+# so a version lost by the cache does not reuse older entries.
+def get_version(key):
+    return cache.get_or_set(f"version:{key}", time.time_ns, timeout=None)
+
+
+def bump_version(key):
+    try:
+        cache.incr(f"version:{key}")
+    except ValueError:
+        cache.set(f"version:{key}", time.time_ns(), timeout=None)
+
+
+def get_or_build(key, version, build):
+    return cache.get_or_set(f"{key}:{version}", build, timeout=NETWORK_DEVICES_CACHE_TIMEOUT)
+
+
+def network_devices_key(ssid):
+    return f"network-devices:{quote(ssid, safe='')}"
+
+
+def followed_devices_key(telegram_id):
+    return f"followed-devices:{telegram_id}"
+
+
+def invalidate_network_devices(ssids):
+    for ssid in ssids:
+        bump_version(network_devices_key(ssid))
+
+
+def invalidate_network_devices_on_commit(changes: dict):
+    # a batch which changed no device keeps the cached lists and their etags
+    ssids = {ssid for ssid, device_ids in changes.items() if device_ids}
+    if ssids:
+        transaction.on_commit(lambda: invalidate_network_devices(ssids))
+
+
+def invalidate_followed_devices(telegram_id):
+    bump_version(followed_devices_key(telegram_id))
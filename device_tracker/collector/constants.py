@@ -1,3 +1,31 @@
 NETWORK_KEY_LENGTH = 4
 TELEGRAM_LISTENER_SOCKET = "http://127.0.0.1:5000"
 UPDATE_NETWORK_STATUS_ENDPOINT = f"{TELEGRAM_LISTENER_SOCKET}/update-network-status"
+# pinger batches carry the pinger id and a growing sequence number
+PINGER_ID_HEADER = "X-Pinger-Id"
+PINGER_SEQUENCE_HEADER = "X-Pinger-Seq"
+# listener notifications: delivery workers, request timeout (sec) and attempts
+NOTIFICATION_WORKERS = 4
+NOTIFICATION_TIMEOUT = 5
+NOTIFICATION_MAX_ATTEMPTS = 3
+NOTIFICATION_RETRY_DELAY = 1
+# at most one update per chat and network within the window (sec)
+NOTIFICATION_DEBOUNCE = 3
+# cached network device lists and followed devices (sec)
+NETWORK_DEVICES_CACHE_TIMEOUT = 600
+# in-memory presence: pending missed pings and last seen times are written
+# behind every flush interval, network state is reloaded after its ttl (sec)
+PRESENCE_FLUSH_INTERVAL = 600
+PRESENCE_STATE_TTL = 3600
+# attempts of an ingestion transaction failed by a locked database (SQLite)
+PRESENCE_LOCK_RETRIES = 3
+PRESENCE_LOCK_RETRY_DELAY = 0.1
+# request instrumentation: queries allowed per request, slow request time (sec),
+# share of slow requests traced and the file they are appended to (None disables)
+REQUEST_QUERY_BUDGET = 25
+SLOW_REQUEST_SECONDS = 1
+SLOW_REQUEST_TRACE_RATE = 0.1
+SLOW_REQUEST_TRACE_FILE = None
+# authenticated tokens are cached in process for (sec)
+TOKEN_CACHE_TTL = 60
+TOKEN_CACHE_MAX_ENTRIES = 1000
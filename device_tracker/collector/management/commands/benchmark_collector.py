@@ -0,0 +1,309 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import requests
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.authtoken.models import Token
+
+from collector.models import Network, Device, Session, TelegramAccount
+from collector.presence import presence
+
+API_PREFIX = "/collector/api/v1"
+INGESTION_ENDPOINT = f"{API_PREFIX}/device-sessions/"
+LISTENER_ENDPOINT = f"{API_PREFIX}/manage-network-devices/"
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE")
+
+
+def mac_addr(i):
+    return ":".join(f"{byte:02x}" for byte in i.to_bytes(6, "big"))
+
+
+def ipv4_addr(i):
+    return f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[round(p * (len(values) - 1))]
+
+
+# Latencies are measured by the client, queries and written rows by a
+# database execute wrapper around every request on the server side.
+class BenchmarkStats:
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(int)
+        self.rows_written = defaultdict(int)
+        self.errors = defaultdict(int)
+        self._lock = Lock()
+
+    def record_latency(self, endpoint, latency, ok):
+        with self._lock:
+            self.latencies[endpoint].append(latency)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    @contextlib.contextmanager
+    def counting(self, endpoint):
+
+        def execute_wrapper(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            rows = context["cursor"].rowcount if sql.lstrip().upper().startswith(WRITE_STATEMENTS) else 0
+            with self._lock:
+                self.queries[endpoint] += 1
+                self.rows_written[endpoint] += max(rows, 0)
+            return result
+
+        with connection.execute_wrapper(execute_wrapper):
+            yield
+
+    def summary(self, transport, elapsed):
+        results = []
+        for endpoint, latencies in sorted(self.latencies.items()):
+            results.append({
+                "transport": transport,
+                "endpoint": endpoint,
+                "requests": len(latencies),
+                "errors": self.errors[endpoint],
+                "p50_ms": percentile(latencies, 0.5) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "queries_per_request": self.queries[endpoint] / len(latencies),
+                "rows_written": self.rows_written[endpoint],
+                "requests_per_sec": len(latencies) / elapsed if elapsed else 0,
+            })
+        return results
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class Command(BaseCommand):
+    help = "Collector ingestion and listener load test on a seeded throwaway database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--networks", type=int, default=10)
+        parser.add_argument("--devices", type=int, default=300, help="Devices per network")
+        parser.add_argument("--history", type=int, default=5, help="Closed sessions per device")
+        parser.add_argument("--batches", type=int, default=200, help="Pinger batches per run")
+        parser.add_argument("--reads", type=int, default=2, help="Listener requests per batch")
+        parser.add_argument("--churn", type=float, default=0.05,
+                            help="Share of devices missing or readdressed in a batch")
+        parser.add_argument("--concurrency", type=int, default=8, help="WSGI server clients")
+        parser.add_argument(
+            "--transports",
+            type=lambda value: value.split(","),
+            default=["client", "wsgi"],
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--save", type=str, default=None, help="Write results to a JSON file")
+        parser.add_argument("--baseline", type=str, default=None,
+                            help="Compare with results saved by --save")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        results = []
+
+        with self.test_database():
+            self.seed(options["networks"], options["devices"], options["history"])
+            for transport in options["transports"]:
+                self.stdout.write(f"benchmark: transport={transport}")
+                results += self.run(transport, options)
+
+        self.print_results(results, self.load_baseline(options["baseline"]))
+        if options["save"]:
+            with open(options["save"], "w") as file:
+                json.dump(results, file, indent=2)
+
+    @contextlib.contextmanager
+    def test_database(self):
+        # a file database, so the server threads share it with their own connections
+        directory = tempfile.mkdtemp(prefix="collector-benchmark-")
+        connection.settings_dict["TEST"]["NAME"] = os.path.join(directory, "db.sqlite3")
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            os.rmdir(directory)
+
+    def seed(self, networks_count, devices_count, history):
+        start_time = time.perf_counter()
+        self.networks = Network.objects.bulk_create([
+            Network(ssid=f"bench-{i}", network_key=f"B{i:03d}", description="", type="W")
+            for i in range(networks_count)
+        ])
+        devices = Device.objects.bulk_create([
+            Device(mac_addr=mac_addr(i), ipv4=ipv4_addr(i), name=f"device-{i}", type="SM")
+            for i in range(networks_count * devices_count)
+        ])
+        self.network_devices = {
+            network.ssid: devices[i * devices_count:(i + 1) * devices_count]
+            for i, network in enumerate(self.networks)
+        }
+
+        sessions = []
+        for network in self.networks:
+            for device in self.network_devices[network.ssid]:
+                sessions += [
+                    Session(network=self.random.choice(self.networks), device=device, status="C")
+                    for _ in range(history)
+                ]
+                sessions.append(Session(network=network, device=device))
+        Session.objects.bulk_create(sessions, batch_size=5000)
+
+        self.accounts = {}
+        for i, network in enumerate(self.networks):
+            owner = User.objects.create(username=f"bench-{i}")
+            account = TelegramAccount.objects.create(telegram_user_id=i, nickname=f"bench-{i}", owner=owner)
+            account.networks_to_track.add(network)
+            network_devices = self.network_devices[network.ssid]
+            account.devices_to_track.add(*network_devices[:max(1, len(network_devices) // 10)])
+            self.accounts[network.ssid] = account
+        self.token = Token.objects.create(user=User.objects.create(username="bench-listener"))
+
+        self.stdout.write(
+            f"seeded {len(self.networks)} networks, {len(devices)} devices, "
+            f"{len(sessions)} sessions in {time.perf_counter() - start_time:.1f} sec"
+        )
+
+    def make_batch(self, ssid, churn):
+        batch = []
+        for device in self.network_devices[ssid]:
+            roll = self.random.random()
+            if roll < churn / 2:
+                continue
+            ipv4 = ipv4_addr(self.random.randrange(2 ** 24)) if roll < churn else device.ipv4
+            batch.append({"network_ssid": ssid, "device_mac_addr": device.mac_addr, "device_ipv4_addr": ipv4})
+        return batch
+
+    def make_requests(self, options):
+        planned = []
+        for _ in range(options["batches"]):
+            ssid = self.random.choice(self.networks).ssid
+            planned.append(("POST", INGESTION_ENDPOINT, self.make_batch(ssid, options["churn"])))
+            for _ in range(options["reads"]):
+                ssid = self.random.choice(self.networks).ssid
+                data = {"network_ssid": ssid, "telegram_user_id": self.accounts[ssid].telegram_user_id}
+                planned.append(("GET", LISTENER_ENDPOINT, data))
+        return planned
+
+    def run(self, transport, options):
+        presence.reset()
+        cache.clear()
+        stats = BenchmarkStats()
+        planned = self.make_requests(options)
+        runners = {"client": self.run_client, "wsgi": self.run_wsgi}
+
+        # failed requests are counted, not logged
+        request_logger = logging.getLogger("django.request")
+        request_logger.disabled = True
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                start_time = time.perf_counter()
+                runners[transport](planned, stats, options)
+                elapsed = time.perf_counter() - start_time
+        finally:
+            request_logger.disabled = False
+
+        return stats.summary(transport, elapsed)
+
+    def run_client(self, planned, stats, options):
+        client = Client(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        for method, endpoint, data in planned:
+            start_time = time.perf_counter()
+            with stats.counting(endpoint):
+                response = client.generic(method, endpoint, json.dumps(data), content_type="application/json")
+            stats.record_latency(endpoint, time.perf_counter() - start_time, response.status_code < 400)
+
+    def run_wsgi(self, planned, stats, options):
+        handler = WSGIHandler()
+
+        def application(environ, start_response):
+            with stats.counting(environ["PATH_INFO"]):
+                return handler(environ, start_response)
+
+        server = make_server(
+            "127.0.0.1", 0, application,
+            server_class=ThreadingWSGIServer,
+            handler_class=QuietRequestHandler,
+        )
+        Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}"
+        headers = {"Authorization": f"Token {self.token.key}"}
+
+        def send(request):
+            method, endpoint, data = request
+            start_time = time.perf_counter()
+            response = requests.request(method, f"{url}{endpoint}", json=data, headers=headers)
+            stats.record_latency(endpoint, time.perf_counter() - start_time, response.ok)
+
+        try:
+            with override_settings(ALLOWED_HOSTS=["127.0.0.1"]), \
+                    ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+                list(executor.map(send, planned))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    @staticmethod
+    def load_baseline(path):
+        if path is None:
+            return {}
+        with open(path) as file:
+            return {(res["transport"], res["endpoint"]): res for res in json.load(file)}
+
+    def print_results(self, results, baseline):
+        header = f"{'transport':<10}{'endpoint':<40}{'requests':>10}{'errors':>8}{'p50,ms':>10}" \
+                 f"{'p99,ms':>10}{'q/req':>8}{'rows':>10}{'req/s':>10}"
+        self.stdout.write(header)
+        for res in results:
+            self.stdout.write(
+                f"{res['transport']:<10}{res['endpoint']:<40}{res['requests']:>10}{res['errors']:>8}"
+                f"{res['p50_ms']:>10.1f}{res['p99_ms']:>10.1f}{res['queries_per_request']:>8.1f}"
+                f"{res['rows_written']:>10}{res['requests_per_sec']:>10.1f}"
+            )
+            base = baseline.get((res["transport"], res["endpoint"]))
+            if base:
+                self.stdout.write(
+                    f"{'  vs baseline':<68}"
+                    f"{self.change(res['p50_ms'], base['p50_ms']):>10}"
+                    f"{self.change(res['p99_ms'], base['p99_ms']):>10}"
+                    f"{self.change(res['queries_per_request'], base['queries_per_request']):>8}"
+                    f"{self.change(res['rows_written'], base['rows_written']):>10}"
+                    f"{self.change(res['requests_per_sec'], base['requests_per_sec']):>10}"
+                )
+
+    @staticmethod
+    def change(value, base):
+        if not base:
+            return "-"
+        return f"{(value - base) / base:+.0%}"
@@ -0,0 +1,104 @@
+from threading import Lock
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (1, 2, 5, 10, 15, 20, 25, 50, 100, 250)
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels)
+    return f"{{{pairs}}}"
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = Lock()
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines += self.render_value(labels, value)
+        return lines
+
+    def render_value(self, labels, value) -> list:
+        return [f"{self.name}{format_labels(labels)} {value}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total, observations = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for index, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value, observations + 1)
+
+    def render_value(self, labels, value) -> list:
+        counts, total, observations = value
+        lines = []
+        for bucket, count in zip(self.buckets, counts):
+            bucket_labels = labels + (("le", bucket),)
+            lines.append(f"{self.name}_bucket{format_labels(bucket_labels)} {count}")
+        lines.append(f"{self.name}_bucket{format_labels(labels + (('le', '+Inf'),))} {observations}")
+        lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {observations}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: Metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "collector_request_seconds", "Wall time of a request per view", SECONDS_BUCKETS,
+))
+REQUEST_QUERIES = REGISTRY.register(Histogram(
+    "collector_request_queries", "SQL queries executed by a request per view", QUERIES_BUCKETS,
+))
+REQUEST_DB_SECONDS = REGISTRY.register(Histogram(
+    "collector_request_db_seconds", "Time spent in SQL queries by a request per view", SECONDS_BUCKETS,
+))
+REQUEST_RENDER_SECONDS = REGISTRY.register(Histogram(
+    "collector_request_render_seconds", "Time spent serializing a response per view", SECONDS_BUCKETS,
+))
+REQUESTS_OVER_BUDGET = REGISTRY.register(Counter(
+    "collector_requests_over_query_budget_total", "Requests which exceeded the query budget per view",
+))
@@ -0,0 +1,116 @@
+import json
+import random
+import time
+from datetime import datetime
+from threading import Lock
+
+from django.db import connection
+from django.utils import timezone
+
+from collector.constants import (
+    REQUEST_QUERY_BUDGET,
+    SLOW_REQUEST_SECONDS,
+    SLOW_REQUEST_TRACE_RATE,
+    SLOW_REQUEST_TRACE_FILE,
+)
+from collector.metrics import (
+    REQUEST_SECONDS,
+    REQUEST_QUERIES,
+    REQUEST_DB_SECONDS,
+    REQUEST_RENDER_SECONDS,
+    REQUESTS_OVER_BUDGET,
+)
+
+
+class RequestStats:
+
+    def __init__(self, keep_queries=False):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.render_seconds = 0.0
+        self.keep_queries = keep_queries
+        self.executed = []
+
+    # database execute wrapper
+    def __call__(self, execute, sql, params, many, context):
+        start_time = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds = time.perf_counter() - start_time
+            self.queries += 1
+            self.db_seconds += seconds
+            if self.keep_queries:
+                self.executed.append({"sql": sql, "seconds": round(seconds, 6)})
+
+
+# Records wall time, SQL queries and their time and response rendering
+# time of every request per view, flags requests which exceed the query
+# budget and appends a sample of slow requests with their SQL to a trace file.
+class RequestMetricsMiddleware:
+    trace_lock = Lock()
+
+    def __init__(self, get_response, query_budget=REQUEST_QUERY_BUDGET,
+                 slow_request_seconds=SLOW_REQUEST_SECONDS,
+                 trace_rate=SLOW_REQUEST_TRACE_RATE, trace_file=SLOW_REQUEST_TRACE_FILE):
+        self.get_response = get_response
+        self.query_budget = query_budget
+        self.slow_request_seconds = slow_request_seconds
+        self.trace_rate = trace_rate
+        self.trace_file = trace_file
+
+    def __call__(self, request):
+        request.request_stats = RequestStats(keep_queries=self.trace_file is not None)
+        start_time = time.perf_counter()
+        with connection.execute_wrapper(request.request_stats):
+            response = self.get_response(request)
+        seconds = time.perf_counter() - start_time
+
+        self.record(request, response, seconds)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns
+        start_time = time.perf_counter()
+
+        def rendered(response):
+            request.request_stats.render_seconds += time.perf_counter() - start_time
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, seconds):
+        stats = request.request_stats
+        match = request.resolver_match
+        view = match.view_name if match else "unresolved"
+
+        REQUEST_SECONDS.observe(seconds, view=view, method=request.method)
+        REQUEST_QUERIES.observe(stats.queries, view=view, method=request.method)
+        REQUEST_DB_SECONDS.observe(stats.db_seconds, view=view, method=request.method)
+        REQUEST_RENDER_SECONDS.observe(stats.render_seconds, view=view, method=request.method)
+
+        if stats.queries > self.query_budget:
+            REQUESTS_OVER_BUDGET.inc(view=view, method=request.method)
+            print(f"{request.method} {request.path} executed {stats.queries} queries, "
+                  f"budget is {self.query_budget}")
+
+        if seconds >= self.slow_request_seconds and self.trace_file is not None \
+                and random.random() < self.trace_rate:
+            self.trace(request, response, seconds, view)
+
+    def trace(self, request, response, seconds, view):
+        stats = request.request_stats
+        trace = {
+            "time": datetime.now(tz=timezone.utc).isoformat(),
+            "method": request.method,
+            "path": request.path,
+            "view": view,
+            "status": response.status_code,
+            "seconds": round(seconds, 6),
+            "queries": stats.queries,
+            "db_seconds": round(stats.db_seconds, 6),
+            "render_seconds": round(stats.render_seconds, 6),
+            "sql": stats.executed,
+        }
+        with self.trace_lock, open(self.trace_file, "a") as file:
+            file.write(json.dumps(trace) + "\n")
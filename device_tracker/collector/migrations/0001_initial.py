@@ -0,0 +1,110 @@
+# Generated by Django 4.1.1 on 2026-10-18 13:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Device',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ipv4', models.GenericIPAddressField(protocol='IPv4')),
+                ('mac_addr', models.CharField(max_length=17, unique=True)),
+                ('name', models.CharField(max_length=20)),
+                ('type', models.CharField(choices=[('SM', 'smartphone'), ('TV', 'tv'), ('TB', 'tablet'), ('LP', 'laptop'), ('PC', 'personal computer'), ('WT', 'watch'), ('RT', 'router'), ('PS', 'play station')], max_length=2)),
+                ('use_icmp', models.BooleanField(default=True)),
+                ('use_tcp', models.BooleanField(default=False)),
+                ('missed_pings', models.IntegerField(default=0)),
+                ('missed_pings_threshold', models.IntegerField(default=2)),
+                ('last_modified', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='devices', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Network',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ssid', models.CharField(max_length=20, unique=True)),
+                ('network_key', models.CharField(max_length=4, unique=True)),
+                ('description', models.CharField(max_length=50)),
+                ('type', models.CharField(choices=[('W', 'wi-fi'), ('L', 'lan')], max_length=1)),
+                ('added_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='added_networks', to=settings.AUTH_USER_MODEL)),
+                ('known_devices', models.ManyToManyField(related_name='known_networks', to='collector.device')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TelegramAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('telegram_user_id', models.IntegerField()),
+                ('nickname', models.CharField(max_length=30)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TelegramChat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('telegram_chat_id', models.IntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TelegramMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('telegram_msg_id', models.IntegerField()),
+                ('network', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_network_messages', to='collector.network')),
+                ('telegram_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_network_messages', to='collector.telegramaccount')),
+                ('telegram_chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_network_messages', to='collector.telegramchat')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='telegramaccount',
+            name='chats',
+            field=models.ManyToManyField(related_name='users', to='collector.telegramchat'),
+        ),
+        migrations.AddField(
+            model_name='telegramaccount',
+            name='devices_to_track',
+            field=models.ManyToManyField(related_name='subscribers', to='collector.device'),
+        ),
+        migrations.AddField(
+            model_name='telegramaccount',
+            name='networks_to_admin',
+            field=models.ManyToManyField(related_name='admins', to='collector.network'),
+        ),
+        migrations.AddField(
+            model_name='telegramaccount',
+            name='networks_to_track',
+            field=models.ManyToManyField(related_name='subscribers', to='collector.network'),
+        ),
+        migrations.AddField(
+            model_name='telegramaccount',
+            name='owner',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='telegram_account', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='Session',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('A', 'active'), ('C', 'closed'), ('F', 'closed forcibly')], default='A', max_length=1)),
+                ('start', models.DateTimeField(auto_now=True)),
+                ('end', models.DateTimeField(null=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sessions', to='collector.device')),
+                ('network', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sessions', to='collector.network')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='device',
+            constraint=models.CheckConstraint(check=models.Q(('use_icmp', models.F('use_tcp')), _negated=True), name='protocol_constraint'),
+        ),
+    ]
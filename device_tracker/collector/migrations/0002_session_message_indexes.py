@@ -0,0 +1,25 @@
+# Generated by Django 4.1.1 on 2026-10-18 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collector', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['status', 'network', 'device'], name='session_status_network_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['device', 'status'], name='session_device_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='telegrammessage',
+            index=models.Index(fields=['telegram_account', 'network'], name='message_account_network_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.1.1 on 2026-10-18 13:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collector', '0002_session_message_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PingerSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pinger_id', models.CharField(max_length=100)),
+                ('sequence', models.BigIntegerField()),
+                ('last_modified', models.DateTimeField(auto_now=True)),
+                ('network', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pinger_sequences', to='collector.network')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='pingersequence',
+            constraint=models.UniqueConstraint(fields=('pinger_id', 'network'), name='unique_pinger_network'),
+        ),
+    ]
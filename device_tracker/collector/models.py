@@ -36,6 +36,11 @@ class TelegramMessage(models.Model):
         on_delete=models.CASCADE,
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["telegram_account", "network"], name="message_account_network_idx"),
+        ]
+
 
 class TelegramChat(models.Model):
     telegram_chat_id = models.IntegerField()
@@ -86,6 +91,31 @@ class Session(models.Model):
     start = models.DateTimeField(auto_now=True)
     end = models.DateTimeField(null=True)
 
+    class Meta:
+        indexes = [
+            # active sessions of a network, device ids are read from the index
+            models.Index(fields=["status", "network", "device"], name="session_status_network_idx"),
+            # active sessions of a batch of devices
+            models.Index(fields=["device", "status"], name="session_device_status_idx"),
+        ]
+
+
+class PingerSequence(models.Model):
+    # the highest batch sequence number processed per pinger and network
+    pinger_id = models.CharField(max_length=100)
+    network = models.ForeignKey(
+        to="Network",
+        related_name="pinger_sequences",
+        on_delete=models.CASCADE,
+    )
+    sequence = models.BigIntegerField()
+    last_modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["pinger_id", "network"], name="unique_pinger_network"),
+        ]
+
 
 class Device(models.Model):
 
@@ -0,0 +1,119 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Timer
+
+import requests
+from django.db import close_old_connections
+from requests.exceptions import RequestException
+
+from collector.constants import (
+    UPDATE_NETWORK_STATUS_ENDPOINT,
+    NOTIFICATION_WORKERS,
+    NOTIFICATION_TIMEOUT,
+    NOTIFICATION_MAX_ATTEMPTS,
+    NOTIFICATION_RETRY_DELAY,
+    NOTIFICATION_DEBOUNCE,
+)
+
+
+# Delivers listener notifications from a bounded pool of worker threads,
+# so ingestion requests never wait for Telegram round trips. A chat which
+# already has an update for the same network queued is not queued twice,
+# and updates following a delivery within the debounce window are delayed
+# until the window ends, so a burst of changes results in a single update.
+class NotificationDispatcher:
+
+    def __init__(self, workers=NOTIFICATION_WORKERS, timeout=NOTIFICATION_TIMEOUT,
+                 max_attempts=NOTIFICATION_MAX_ATTEMPTS, retry_delay=NOTIFICATION_RETRY_DELAY,
+                 debounce=NOTIFICATION_DEBOUNCE):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.debounce = debounce
+        self._executor = None
+        self._queued = set()
+        self._last_sent = {}
+        self._pruned_at = time.monotonic()
+        self._lock = Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix="notification",
+                )
+            return self._executor
+
+    def submit(self, func, *args):
+        self.executor.submit(self._run_task, func, *args)
+
+    def enqueue(self, chat_id, network_ssid):
+        key = (chat_id, network_ssid)
+        with self._lock:
+            if key in self._queued:
+                print(f"notification for chat: {chat_id} network: {network_ssid} already queued")
+                return
+            self._queued.add(key)
+            delay = self._last_sent.get(key, float("-inf")) + self.debounce - time.monotonic()
+
+        if delay > 0:
+            print(f"notification for chat: {chat_id} network: {network_ssid} "
+                  f"debounced for {delay:.1f} sec")
+            timer = Timer(delay, self.executor.submit, args=(self._deliver, chat_id, network_ssid))
+            timer.daemon = True
+            timer.start()
+        else:
+            self.executor.submit(self._deliver, chat_id, network_ssid)
+
+    @staticmethod
+    def _run_task(func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"notification task {func.__name__}{args} failed: {e}")
+        finally:
+            close_old_connections()
+
+    def _prune(self, now):
+        # deliveries outside the debounce window delay nothing, they are
+        # dropped at most once per window to keep the map bounded
+        if now - self._pruned_at < self.debounce:
+            return
+        self._last_sent = {
+            key: sent_at for key, sent_at in self._last_sent.items() if now - sent_at < self.debounce
+        }
+        self._pruned_at = now
+
+    def _deliver(self, chat_id, network_ssid):
+        key = (chat_id, network_ssid)
+        with self._lock:
+            self._queued.discard(key)
+            now = time.monotonic()
+            self._prune(now)
+            self._last_sent[key] = now
+
+        data = {"chat_id": chat_id, "network_ssid": network_ssid}
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                response = requests.post(
+                    url=UPDATE_NETWORK_STATUS_ENDPOINT,
+                    json=data,
+                    timeout=self.timeout,
+                )
+                print(f"{UPDATE_NETWORK_STATUS_ENDPOINT} response: {response}")
+                if response.ok:
+                    return
+            except RequestException as e:
+                print(f"{UPDATE_NETWORK_STATUS_ENDPOINT} error: {e}")
+
+            if attempt < self.max_attempts:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+        print(f"notification for chat: {chat_id} network: {network_ssid} dropped "
+              f"after {self.max_attempts} attempts")
+
+
+dispatcher = NotificationDispatcher()
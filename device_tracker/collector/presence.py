@@ -0,0 +1,310 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from ipaddress import IPv4Address
+from threading import Lock, RLock, local
+
+from django.db import OperationalError, transaction
+from django.utils import timezone
+
+from collector.caching import invalidate_network_devices
+from collector.constants import (
+    PRESENCE_FLUSH_INTERVAL,
+    PRESENCE_STATE_TTL,
+    PRESENCE_LOCK_RETRIES,
+    PRESENCE_LOCK_RETRY_DELAY,
+)
+from collector.models import Device, Session
+from collector.utils import ingest_device_sessions
+
+
+class DevicePresence:
+
+    def __init__(self, device_id, ipv4, missed_pings, missed_pings_threshold):
+        self.device_id = device_id
+        self.ipv4 = ipv4
+        self.missed_pings = missed_pings
+        self.missed_pings_threshold = missed_pings_threshold
+        self.last_seen = None
+
+
+class NetworkPresence:
+
+    def __init__(self, ssid):
+        self.ssid = ssid
+        self.devices = {}
+        self.dirty = set()
+        self.loaded_at = None
+        self.flushed_at = time.monotonic()
+        self.lock = RLock()
+
+    @property
+    def live_devices(self):
+        return [mac_addr for mac_addr, device in self.devices.items() if not device.missed_pings]
+
+    def load(self):
+        rows = (
+            Device.objects.filter(sessions__network__ssid=self.ssid, sessions__status="A").
+            distinct().
+            values_list("mac_addr", "id", "ipv4", "missed_pings", "missed_pings_threshold")
+        )
+        self.devices = {mac_addr: DevicePresence(*row) for mac_addr, *row in rows}
+        self.dirty.clear()
+        self.loaded_at = time.monotonic()
+
+    def reset(self):
+        self.devices = {}
+        self.dirty.clear()
+        self.loaded_at = None
+
+
+# Holds liveness of devices with an active session per network in memory,
+# so a scan cycle only writes state transitions: new devices and changed
+# addresses, devices which started or stopped missing pings and lost
+# devices whose sessions are closed. Growing missed ping counters and last
+# seen times are written behind in batches once per flush interval.
+class PresenceEngine:
+
+    def __init__(self, flush_interval=PRESENCE_FLUSH_INTERVAL, state_ttl=PRESENCE_STATE_TTL,
+                 lock_retries=PRESENCE_LOCK_RETRIES, lock_retry_delay=PRESENCE_LOCK_RETRY_DELAY):
+        self.flush_interval = flush_interval
+        self.state_ttl = state_ttl
+        self.lock_retries = lock_retries
+        self.lock_retry_delay = lock_retry_delay
+        self._networks = {}
+        self._lock = Lock()
+        self._local = local()
+
+    def network(self, ssid) -> NetworkPresence:
+        with self._lock:
+            if ssid not in self._networks:
+                self._networks[ssid] = NetworkPresence(ssid)
+            return self._networks[ssid]
+
+    def observe_snapshot(self, ssid, devices_data, network_object=None) -> dict:
+        network = self.network(ssid)
+        with network.lock, self._transaction(network):
+            changes = self._ingest(network, devices_data, network_object)
+            live_mac_addresses = {data["device_mac_addr"] for data in devices_data}
+            missing_mac_addresses = network.devices.keys() - live_mac_addresses
+            changes[ssid].update(self._apply(network, live_mac_addresses, missing_mac_addresses))
+            self._flush_if_due(network)
+        return changes
+
+    def observe_delta(self, ssid, appeared, changed, disappeared, live_devices, partial=False,
+                      scanned=(), complete=False):
+        network = self.network(ssid)
+        with network.lock, self._transaction(network):
+            changes = self._ingest(network, appeared + changed)
+            reported_mac_addresses = {data["device_mac_addr"] for data in appeared + changed}
+
+            if partial:
+                # a partial scan says nothing about unscanned devices, a scanned
+                # device missed the ping unless it was reported or stayed live,
+                # so missing devices keep missing until they appear again
+                scanned_mac_addresses = {
+                    mac_addr for mac_addr, device in network.devices.items()
+                    if any(IPv4Address(device.ipv4) in scanned_range for scanned_range in scanned)
+                }
+                live_mac_addresses = set(reported_mac_addresses)
+                if not complete:
+                    live_mac_addresses |= scanned_mac_addresses & set(network.live_devices) - set(disappeared)
+                missing_mac_addresses = scanned_mac_addresses - live_mac_addresses | set(disappeared)
+                changes[ssid].update(self._apply(network, live_mac_addresses, missing_mac_addresses))
+                self._flush_if_due(network)
+                print(f"partial delta for `{ssid}` applied")
+                return changes, False
+
+            # devices which were live and did not disappear are still live,
+            # missing devices keep missing until they are reported again
+            live_mac_addresses = (
+                set(network.live_devices) - set(disappeared) | reported_mac_addresses
+            )
+            missing_mac_addresses = network.devices.keys() - live_mac_addresses
+            changes[ssid].update(self._apply(network, live_mac_addresses, missing_mac_addresses))
+            self._flush_if_due(network)
+
+            collector_live_devices = len(network.live_devices)
+
+        resync = collector_live_devices != live_devices
+        if resync:
+            print(f"delta for `{ssid}` is out of sync: pinger reports {live_devices} live "
+                  f"devices, collector has {collector_live_devices}")
+        return changes, resync
+
+    def flush(self):
+        with self._lock:
+            networks = list(self._networks.values())
+        for network in networks:
+            with network.lock, transaction.atomic():
+                self._flush(network)
+
+    def reset(self):
+        with self._lock:
+            self._networks.clear()
+
+    def run(self, func, *args, **kwargs):
+        # SQLite fails a transaction which has to upgrade its read lock while
+        # another one writes at once instead of waiting on the busy timeout,
+        # the whole transaction is retried then
+        is_nested = getattr(self._local, "observed", None) is not None
+        for attempt in range(1, self.lock_retries + 1):
+            try:
+                with self.atomic():
+                    return func(*args, **kwargs)
+            except OperationalError as e:
+                if is_nested or attempt == self.lock_retries or "locked" not in str(e):
+                    raise
+                print(f"presence transaction failed: {e} - retry {attempt}")
+                time.sleep(self.lock_retry_delay * attempt)
+
+    @contextmanager
+    def atomic(self):
+        # memory is ahead of the database until the outermost transaction
+        # commits, so presence owns it: networks observed in a transaction
+        # which rolls back or fails to commit are reloaded from the database
+        observed = getattr(self._local, "observed", None)
+        if observed is not None:
+            try:
+                with transaction.atomic():
+                    yield
+            except Exception:
+                self._reset_observed(observed)
+                raise
+            return
+
+        observed = self._local.observed = set()
+        committed = False
+        try:
+            with transaction.atomic():
+                yield
+                rolled_back = transaction.get_rollback()
+            committed = not rolled_back
+        finally:
+            self._local.observed = None
+            if not committed:
+                self._reset_observed(observed)
+
+    def _reset_observed(self, networks):
+        for network in networks:
+            with network.lock:
+                network.reset()
+        if networks:
+            print(f"presence of {', '.join(sorted(network.ssid for network in networks))} "
+                  f"is reset after rollback")
+
+    @contextmanager
+    def _transaction(self, network):
+        with self.atomic():
+            self._local.observed.add(network)
+            if network.loaded_at is None or time.monotonic() - network.loaded_at > self.state_ttl:
+                self._flush(network)
+                network.load()
+            yield
+
+    def _ingest(self, network, devices_data, network_object=None) -> dict:
+        # only devices without an active session here or with a changed address are written
+        ingested = [
+            data for data in devices_data
+            if data["device_mac_addr"] not in network.devices
+            or network.devices[data["device_mac_addr"]].ipv4 != data["device_ipv4_addr"]
+        ]
+        if not ingested:
+            return defaultdict(set)
+
+        changes = ingest_device_sessions(network.ssid, ingested, network=network_object)
+        for ssid in changes.keys() - {network.ssid}:
+            # devices moved away from these networks, their state is reloaded
+            self.network(ssid).loaded_at = None
+
+        rows = (
+            Device.objects.filter(mac_addr__in=[data["device_mac_addr"] for data in ingested]).
+            values_list("mac_addr", "id", "ipv4", "missed_pings", "missed_pings_threshold")
+        )
+        for mac_addr, *row in rows:
+            device = network.devices.get(mac_addr)
+            if device is None:
+                network.devices[mac_addr] = DevicePresence(*row)
+            else:
+                device.ipv4 = row[1]
+        return changes
+
+    def _apply(self, network, live_mac_addresses, missing_mac_addresses) -> set:
+        now = datetime.now(tz=timezone.utc)
+        recovered, missing, lost = [], [], []
+
+        for mac_addr in live_mac_addresses:
+            device = network.devices.get(mac_addr)
+            if device is None:
+                continue
+            if device.missed_pings:
+                device.missed_pings = 0
+                recovered.append(device.device_id)
+            device.last_seen = now
+            network.dirty.add(mac_addr)
+
+        for mac_addr in missing_mac_addresses:
+            device = network.devices.get(mac_addr)
+            if device is None:
+                continue
+            device.missed_pings += 1
+            if device.missed_pings > device.missed_pings_threshold:
+                lost.append(device.device_id)
+                del network.devices[mac_addr]
+                network.dirty.discard(mac_addr)
+            elif device.missed_pings == 1:
+                missing.append(device.device_id)
+            else:
+                network.dirty.add(mac_addr)
+
+        if recovered:
+            Device.objects.filter(id__in=recovered).update(missed_pings=0, last_modified=now)
+        if missing:
+            Device.objects.filter(id__in=missing).update(missed_pings=1)
+        if lost:
+            Device.objects.filter(id__in=lost).update(missed_pings=0)
+            (Session.objects.filter(device_id__in=lost, network__ssid=network.ssid, status="A").
+             update(end=now, status="C"))
+
+        print(f"presence of `{network.ssid}`: {len(recovered)} recovered, "
+              f"{len(missing)} missing, {len(lost)} lost")
+        return set(recovered + missing + lost)
+
+    def _flush_if_due(self, network):
+        if time.monotonic() - network.flushed_at >= self.flush_interval:
+            self._flush(network)
+
+    def _flush(self, network):
+        # one statement per distinct value, devices share the time of the cycle they were last seen
+        missed_pings, last_seen = defaultdict(list), defaultdict(list)
+        for mac_addr in network.dirty:
+            device = network.devices.get(mac_addr)
+            if device is None:
+                continue
+            if device.missed_pings:
+                missed_pings[device.missed_pings].append(device.device_id)
+            if device.last_seen is not None:
+                last_seen[device.last_seen].append(device.device_id)
+                device.last_seen = None
+
+        # devices which left the network meanwhile are not written
+        active_devices = Device.objects.filter(
+            sessions__network__ssid=network.ssid,
+            sessions__status="A",
+        )
+        for value, device_ids in missed_pings.items():
+            active_devices.filter(id__in=device_ids).update(missed_pings=value)
+        for value, device_ids in last_seen.items():
+            active_devices.filter(id__in=device_ids).update(last_modified=value)
+
+        if network.dirty:
+            # written behind counters and last seen times are part of the cached
+            # device list, so a flush invalidates it even without a state change
+            transaction.on_commit(lambda ssid=network.ssid: invalidate_network_devices([ssid]))
+            print(f"presence of `{network.ssid}` flushed: {len(network.dirty)} devices")
+        network.dirty.clear()
+        network.flushed_at = time.monotonic()
+
+
+presence = PresenceEngine()
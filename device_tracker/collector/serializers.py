@@ -1,3 +1,5 @@
+from ipaddress import IPv4Network
+
 from django.core.exceptions import ObjectDoesNotExist
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
@@ -7,6 +9,7 @@ from collector.models import (
     Session,
     TelegramAccount, Device, TelegramMessage, TelegramChat,
 )
+from collector.caching import invalidate_followed_devices
 from collector.utils import get_network_key
 
 
@@ -28,6 +31,21 @@ class NetworkSerializer(serializers.ModelSerializer):
         return internal_data
 
 
+class UpdateCreateSessionListSerializer(serializers.ListSerializer):
+
+    def validate(self, attrs):
+        # one query for the whole batch instead of one per device,
+        # networks are kept for the view to ingest every network of the batch
+        ssids = {data["network"]["ssid"] for data in attrs}
+        self.networks = {network.ssid: network for network in Network.objects.filter(ssid__in=ssids)}
+        missing_ssids = ssids - self.networks.keys()
+        if missing_ssids:
+            err = f"ssid: {', '.join(sorted(missing_ssids))} does not exist - create it firstly"
+            print(err)
+            raise serializers.ValidationError(err)
+        return attrs
+
+
 class UpdateCreateSessionSerializer(serializers.ModelSerializer):
     device_mac_addr = serializers.CharField(source="device.mac_addr")
     device_ipv4_addr = serializers.IPAddressField(source="device.ipv4")
@@ -36,6 +54,29 @@ class UpdateCreateSessionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Session
         fields = ["device_mac_addr", "device_ipv4_addr", "network_ssid"]
+        list_serializer_class = UpdateCreateSessionListSerializer
+
+
+class DeltaDeviceSerializer(serializers.Serializer):
+    device_mac_addr = serializers.CharField(max_length=17)
+    device_ipv4_addr = serializers.IPAddressField(protocol="IPv4")
+
+
+class HeartbeatSerializer(serializers.Serializer):
+    live_devices = serializers.IntegerField(min_value=0)
+
+
+class DeviceSessionsDeltaSerializer(serializers.Serializer):
+    network_ssid = serializers.CharField()
+    appeared = DeltaDeviceSerializer(many=True)
+    changed = DeltaDeviceSerializer(many=True)
+    disappeared = serializers.ListField(child=serializers.CharField(max_length=17))
+    heartbeat = HeartbeatSerializer()
+    partial = serializers.BooleanField(default=False)
+    # address ranges probed by a partial cycle, `complete` tells that every
+    # live device of them is reported, not only the appeared and changed ones
+    scanned = serializers.ListField(child=serializers.CharField(), default=list)
+    complete = serializers.BooleanField(default=False)
 
     def validate_network_ssid(self, value):
         if Network.objects.filter(ssid=value).exists():
@@ -45,6 +86,12 @@ class UpdateCreateSessionSerializer(serializers.ModelSerializer):
             print(err)
             raise serializers.ValidationError(err)
 
+    def validate_scanned(self, value):
+        try:
+            return [IPv4Network(scanned_range) for scanned_range in value]
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
 
 class TelegramAccountSerializer(serializers.ModelSerializer):
     chat = serializers.IntegerField(source="chats.telegram_chat_id")
@@ -55,9 +102,6 @@ class TelegramAccountSerializer(serializers.ModelSerializer):
 
 
 class NetworkDevicesSerializer(serializers.ModelSerializer):
-    # will find method with name -> `get_{variable_name}`
-    is_followed_by_user = serializers.SerializerMethodField()
-
     class Meta:
         fields = [
             "id",
@@ -65,17 +109,15 @@ class NetworkDevicesSerializer(serializers.ModelSerializer):
             "name",
             "missed_pings",
             "last_modified",
-            "is_followed_by_user",
         ]
         model = Device
 
-    def get_is_followed_by_user(self, device: Device) -> bool:
-        telegram_acc = (
-            TelegramAccount.objects.get(
-                telegram_user_id=self.context.get("telegram_id")
-            )
-        )
-        return telegram_acc in device.subscribers.all()
+
+class DeviceProtocolSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Device
+        fields = ["mac_addr", "ipv4", "use_icmp", "use_tcp"]
 
 
 class RegisterMessageSerializer(serializers.ModelSerializer):
@@ -150,5 +192,6 @@ class DeviceFollowSerializer(serializers.ModelSerializer):
             telegram_account.devices_to_track.add(device)
         else:
             telegram_account.devices_to_track.remove(device)
+        invalidate_followed_devices(telegram_user_id)
 
         return telegram_account
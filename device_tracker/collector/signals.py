@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from collector.authentication import token_cache
+
+
+@receiver([post_save, post_delete], sender=Token)
+def invalidate_token(sender, instance: Token, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def invalidate_user_tokens(sender, instance, **kwargs):
+    # a deactivated or deleted user must not stay authenticated
+    token_cache.invalidate_user(instance.pk)
@@ -1,3 +1,635 @@
-from django.test import TestCase
+import json
+import tempfile
+import time
+from contextlib import contextmanager
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.test import TestCase, SimpleTestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from requests.exceptions import RequestException
+from rest_framework.authtoken.models import Token
+
+from collector.models import (
+    Network,
+    Device,
+    Session,
+    TelegramAccount,
+    TelegramChat,
+    TelegramMessage,
+)
+from collector.authentication import token_cache
+from collector.metrics import REQUESTS_OVER_BUDGET
+from collector.middleware import RequestMetricsMiddleware
+from collector.notifications import NotificationDispatcher
+from collector.presence import presence
+from collector.utils import (
+    notify_network_subscribers,
+    ingest_device_sessions,
+    get_network_devices,
+)
+
+SEED_NETWORKS = 10
+SEED_DEVICES_PER_NETWORK = 300
+SEED_ACCOUNTS = 20
+SEED_FOLLOWED_DEVICES = 50
+
+
+def mac_addr(i):
+    return ":".join(f"{byte:02x}" for byte in i.to_bytes(6, "big"))
+
+
+def ipv4_addr(i):
+    return f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+
+
+# Thousands of devices spread over several networks, each with an active
+# session in its own network and a closed one in the next network, plus
+# telegram accounts following devices and holding network messages.
+class SeededTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.networks = Network.objects.bulk_create([
+            Network(ssid=f"net-{i}", network_key=f"K{i:03d}", description="", type="W")
+            for i in range(SEED_NETWORKS)
+        ])
+        cls.devices = Device.objects.bulk_create([
+            Device(mac_addr=mac_addr(i), ipv4=ipv4_addr(i), name=f"device-{i}", type="SM")
+            for i in range(SEED_NETWORKS * SEED_DEVICES_PER_NETWORK)
+        ])
+        sessions = []
+        for i, device in enumerate(cls.devices):
+            network = cls.networks[i // SEED_DEVICES_PER_NETWORK]
+            previous_network = cls.networks[(i // SEED_DEVICES_PER_NETWORK + 1) % SEED_NETWORKS]
+            sessions.append(Session(network=previous_network, device=device, status="C"))
+            sessions.append(Session(network=network, device=device))
+        Session.objects.bulk_create(sessions)
+
+        cls.network = cls.networks[0]
+        cls.network_devices = cls.devices[:SEED_DEVICES_PER_NETWORK]
+        cls.chat = TelegramChat.objects.create(telegram_chat_id=1)
+        cls.accounts = []
+        for i in range(SEED_ACCOUNTS):
+            owner = User.objects.create(username=f"user-{i}")
+            account = TelegramAccount.objects.create(
+                telegram_user_id=i, nickname=f"user-{i}", owner=owner,
+            )
+            account.networks_to_track.add(*cls.networks)
+            account.devices_to_track.add(*cls.network_devices[i:i + SEED_FOLLOWED_DEVICES])
+            TelegramMessage.objects.bulk_create([
+                TelegramMessage(
+                    telegram_msg_id=i, telegram_chat=cls.chat, telegram_account=account, network=network,
+                )
+                for network in cls.networks
+            ])
+            cls.accounts.append(account)
+
+        cls.user = User.objects.create(username="listener")
+        cls.token = Token.objects.create(user=cls.user)
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        patcher = mock.patch("collector.notifications.requests.post")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        token_cache.clear()
+        presence.reset()
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        queries = "\n".join(query["sql"] for query in context.captured_queries)
+        self.assertLessEqual(
+            len(context), budget,
+            f"{len(context)} queries executed, budget is {budget}:\n{queries}",
+        )
+
+    def assertIndexUsed(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def snapshot(self, ssid, devices):
+        return [
+            {"network_ssid": ssid, "device_mac_addr": device.mac_addr, "device_ipv4_addr": device.ipv4}
+            for device in devices
+        ]
+
+
+class DeviceSessionsQueryBudgetTest(SeededTestCase):
+    url = "/collector/api/v1/device-sessions/"
+
+    def post_snapshot(self, devices, ssid="net-0"):
+        return self.client.post(self.url, self.snapshot(ssid, devices), content_type="application/json")
+
+    def test_snapshot_query_count_does_not_grow_with_batch_size(self):
+        # sizes fit into a single bulk insert on every backend,
+        # larger batches add one insert per backend batch only
+        counts = []
+        for size, network in ((10, self.networks[1]), (50, self.networks[2])):
+            network_devices = list(get_network_devices(network.ssid))
+            self.post_snapshot(network_devices, network.ssid)
+            with self.assertMaxQueries(20) as context:
+                response = self.post_snapshot(network_devices + self.devices[-size:], network.ssid)
+            self.assertEqual(response.status_code, 200, response.content)
+            counts.append(len(context))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_snapshot_of_whole_network(self):
+        with self.assertMaxQueries(24):
+            response = self.post_snapshot(self.network_devices)
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_snapshot_moving_devices_between_networks(self):
+        moving_devices = self.devices[-SEED_DEVICES_PER_NETWORK:]
+        with self.assertMaxQueries(24):
+            response = self.post_snapshot(moving_devices)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            Session.objects.filter(device__in=moving_devices, network=self.network, status="A").count(),
+            len(moving_devices),
+        )
+
+    def test_batch_of_several_networks(self):
+        other_network = self.networks[1]
+        other_network_devices = list(get_network_devices(other_network.ssid))
+        batch = (
+            self.snapshot(self.network.ssid, self.network_devices[1:]) +
+            self.snapshot(other_network.ssid, other_network_devices[1:])
+        )
+        with self.assertMaxQueries(30) as context:
+            response = self.client.post(self.url, batch, content_type="application/json")
+        self.assertEqual(response.status_code, 200, response.content)
+
+        network_lookups = [
+            query["sql"] for query in context.captured_queries
+            if query["sql"].startswith('SELECT "collector_network"')
+        ]
+        self.assertEqual(len(network_lookups), 1, network_lookups)
+        missing_devices = Device.objects.filter(id__in=[self.network_devices[0].id, other_network_devices[0].id])
+        self.assertEqual([device.missed_pings for device in missing_devices], [1, 1])
+
+    def test_delta(self):
+        data = {
+            "mode": "delta",
+            "network_ssid": self.network.ssid,
+            "appeared": self.snapshot(self.network.ssid, self.devices[-100:]),
+            "changed": [],
+            "disappeared": [device.mac_addr for device in self.network_devices[:100]],
+            "heartbeat": {"live_devices": SEED_DEVICES_PER_NETWORK},
+        }
+        with self.assertMaxQueries(25):
+            response = self.client.post(self.url, data, content_type="application/json")
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_unchanged_snapshot_writes_nothing(self):
+        self.post_snapshot(self.network_devices)
+        with CaptureQueriesContext(connection) as context:
+            response = self.post_snapshot(self.network_devices)
+        self.assertEqual(response.status_code, 200, response.content)
+        writes = [
+            query["sql"] for query in context.captured_queries
+            if query["sql"].startswith(("INSERT", "UPDATE", "DELETE"))
+        ]
+        self.assertEqual(writes, [])
+
+    def test_missed_pings_are_written_behind(self):
+        missing_device = self.network_devices[0]
+        for _ in range(2):
+            with self.assertMaxQueries(12):
+                self.post_snapshot(self.network_devices[1:])
+        missing_device.refresh_from_db()
+        self.assertEqual(missing_device.missed_pings, 1)
+
+        presence.flush()
+        missing_device.refresh_from_db()
+        self.assertEqual(missing_device.missed_pings, 2)
+
+        self.post_snapshot(self.network_devices[1:])
+        missing_device.refresh_from_db()
+        self.assertEqual(missing_device.missed_pings, 0)
+        self.assertEqual(
+            Session.objects.get(device=missing_device, network=self.network).status, "C",
+        )
+
+
+class PingerBatchDedupTest(SeededTestCase):
+    url = "/collector/api/v1/device-sessions/"
+
+    def post_batch(self, pinger_id, sequence):
+        return self.client.post(
+            self.url,
+            self.snapshot(self.network.ssid, self.network_devices[1:]),
+            content_type="application/json",
+            HTTP_X_PINGER_ID=pinger_id,
+            HTTP_X_PINGER_SEQ=sequence,
+        )
+
+    def test_repeated_and_stale_batches_are_skipped(self):
+        missing_device = self.network_devices[0]
+        self.assertIsInstance(self.post_batch("pinger", "10").json(), list)
+
+        for sequence in ("10", "9"):
+            with CaptureQueriesContext(connection) as context:
+                response = self.post_batch("pinger", sequence)
+            self.assertEqual(response.json(), {"duplicate": True, "sequence": 10})
+            writes = [
+                query["sql"] for query in context.captured_queries
+                if query["sql"].startswith(("INSERT", "UPDATE", "DELETE"))
+            ]
+            self.assertEqual(len(writes), 1, writes)
+
+        self.assertIsInstance(self.post_batch("pinger", "11").json(), list)
+        presence.flush()
+        missing_device.refresh_from_db()
+        self.assertEqual(missing_device.missed_pings, 2)
+        self.assertIsInstance(self.post_batch("other-pinger", "1").json(), list)
+
+    def test_invalid_sequence(self):
+        response = self.post_batch("pinger", "ten")
+        self.assertEqual(response.status_code, 400)
+
+
+class PresenceRollbackTest(SeededTestCase):
+    url = "/collector/api/v1/device-sessions/"
+    new_device = {"device_mac_addr": "02:00:00:00:00:01", "device_ipv4_addr": "10.255.0.1"}
+
+    def batch(self, network, device=None):
+        return [{**(device or self.new_device), "network_ssid": network.ssid}]
+
+    def assertIngested(self, network, device=None):
+        self.assertTrue(
+            Session.objects.filter(
+                device__mac_addr=(device or self.new_device)["device_mac_addr"], network=network, status="A",
+            ).exists()
+        )
+
+    def test_rolled_back_snapshot_is_ingested_again(self):
+        with self.assertRaises(RuntimeError), presence.atomic():
+            presence.observe_snapshot(self.network.ssid, self.batch(self.network))
+            raise RuntimeError("commit failed")
+        self.assertFalse(Device.objects.filter(mac_addr=self.new_device["device_mac_addr"]).exists())
+
+        presence.observe_snapshot(self.network.ssid, self.batch(self.network))
+        self.assertIngested(self.network)
+
+    def test_rollback_without_exception_resets_presence(self):
+        with presence.atomic():
+            presence.observe_snapshot(self.network.ssid, self.batch(self.network))
+            transaction.set_rollback(True)
+
+        presence.observe_snapshot(self.network.ssid, self.batch(self.network))
+        self.assertIngested(self.network)
+
+    def test_failed_batch_of_several_networks_is_ingested_again(self):
+        other_network = self.networks[1]
+        other_device = {"device_mac_addr": "02:00:00:00:00:02", "device_ipv4_addr": "10.255.0.2"}
+        batch = self.batch(self.network) + self.batch(other_network, other_device)
+
+        def ingest(ssid, devices_data, network=None):
+            if ssid == other_network.ssid:
+                raise RuntimeError("database is locked")
+            return ingest_device_sessions(ssid, devices_data, network=network)
+
+        with mock.patch("collector.presence.ingest_device_sessions", side_effect=ingest), \
+                self.assertRaises(RuntimeError):
+            self.client.post(self.url, batch, content_type="application/json")
+        self.assertFalse(Session.objects.filter(device__mac_addr=self.new_device["device_mac_addr"]).exists())
+
+        response = self.client.post(self.url, batch, content_type="application/json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertIngested(self.network)
+        self.assertIngested(other_network, other_device)
+
+    def test_locked_database_retries_the_batch(self):
+        side_effect = [OperationalError("database is locked"), ingest_device_sessions]
+
+        def ingest(*args, **kwargs):
+            effect = side_effect.pop(0)
+            if isinstance(effect, Exception):
+                raise effect
+            return effect(*args, **kwargs)
+
+        with mock.patch("collector.presence.ingest_device_sessions", side_effect=ingest), \
+                mock.patch("collector.presence.time.sleep"):
+            response = self.client.post(self.url, self.batch(self.network), content_type="application/json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertIngested(self.network)
+
+
+
+class PartialDeltaTest(SeededTestCase):
+    url = "/collector/api/v1/device-sessions/"
+
+    def partial_delta(self, disappeared=(), complete=False):
+        return {
+            "mode": "delta",
+            "network_ssid": self.network.ssid,
+            "appeared": self.snapshot(self.network.ssid, self.network_devices[1:10]) if complete else [],
+            "changed": [],
+            "disappeared": list(disappeared),
+            "heartbeat": {"live_devices": SEED_DEVICES_PER_NETWORK - 1},
+            "partial": True,
+            "scanned": [f"{self.network_devices[0].ipv4}/32", f"{self.network_devices[1].ipv4}/32"],
+            "complete": complete,
+        }
+
+    def assertSessionStatus(self, device, session_status):
+        self.assertEqual(Session.objects.get(device=device, network=self.network).status, session_status)
+
+    def post_partial_deltas(self, deltas):
+        for data in deltas:
+            response = self.client.post(self.url, data, content_type="application/json")
+            self.assertEqual(response.status_code, 200, response.content)
+        presence.flush()
+
+    def test_missing_device_is_counted_until_session_is_closed(self):
+        departed, other = self.network_devices[0], self.network_devices[1]
+        deltas = [self.partial_delta(disappeared=[departed.mac_addr])]
+        deltas += [self.partial_delta()] * departed.missed_pings_threshold
+        self.post_partial_deltas(deltas)
+        self.assertSessionStatus(departed, "C")
+        self.assertSessionStatus(other, "A")
+        self.assertEqual(Device.objects.get(id=other.id).missed_pings, 0)
+
+    def test_complete_partial_delta_closes_unreported_device(self):
+        departed, unscanned = self.network_devices[0], self.network_devices[10]
+        self.post_partial_deltas([self.partial_delta(complete=True)] * (departed.missed_pings_threshold + 1))
+        self.assertSessionStatus(departed, "C")
+        self.assertSessionStatus(unscanned, "A")
+
+    def test_invalid_scanned_range_is_rejected(self):
+        data = {**self.partial_delta(), "scanned": ["10.0.0.300/32"]}
+        response = self.client.post(self.url, data, content_type="application/json")
+        self.assertEqual(response.status_code, 400, response.content)
+
+
+class ListenerQueryBudgetTest(SeededTestCase):
+
+    def get_network_devices(self, telegram_user_id, **headers):
+        return self.client.generic(
+            "GET", "/collector/api/v1/manage-network-devices/",
+            data=f'{{"network_ssid": "{self.network.ssid}", "telegram_user_id": {telegram_user_id}}}',
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {self.token.key}",
+            **headers,
+        )
+
+    def test_network_devices(self):
+        with self.assertMaxQueries(6):
+            response = self.get_network_devices(self.accounts[0].telegram_user_id)
+        self.assertEqual(response.status_code, 200, response.content)
+        devices = response.json()["devices"]
+        self.assertEqual(len(devices), SEED_DEVICES_PER_NETWORK)
+        followed = [device for device in devices if device["is_followed_by_user"]]
+        self.assertEqual(len(followed), SEED_FOLLOWED_DEVICES)
+
+    def test_cached_network_devices(self):
+        response = self.get_network_devices(self.accounts[0].telegram_user_id)
+        with self.assertMaxQueries(3):
+            cached_response = self.get_network_devices(self.accounts[0].telegram_user_id)
+        self.assertEqual(cached_response.json(), response.json())
+        self.assertEqual(cached_response["ETag"], response["ETag"])
+
+        with self.assertMaxQueries(3):
+            response = self.get_network_devices(
+                self.accounts[0].telegram_user_id, HTTP_IF_NONE_MATCH=response["ETag"],
+            )
+        self.assertEqual(response.status_code, 304)
+
+    def test_network_devices_invalidated_by_ingestion(self):
+        response = self.get_network_devices(self.accounts[0].telegram_user_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                "/collector/api/v1/device-sessions/",
+                self.snapshot(self.network.ssid, self.network_devices[1:]),
+                content_type="application/json",
+            )
+        response = self.get_network_devices(
+            self.accounts[0].telegram_user_id, HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(response.status_code, 200)
+        missing = [device for device in response.json()["devices"] if device["missed_pings"]]
+        self.assertEqual(len(missing), 1)
+
+    def test_network_devices_kept_by_unchanged_ingestion(self):
+        response = self.get_network_devices(self.accounts[0].telegram_user_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                "/collector/api/v1/device-sessions/",
+                self.snapshot(self.network.ssid, self.network_devices),
+                content_type="application/json",
+            )
+        response = self.get_network_devices(
+            self.accounts[0].telegram_user_id, HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            presence.flush()
+        response = self.get_network_devices(
+            self.accounts[0].telegram_user_id, HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_network_devices_invalidated_by_follow(self):
+        account = self.accounts[0]
+        response = self.get_network_devices(account.telegram_user_id)
+        other_response = self.get_network_devices(self.accounts[1].telegram_user_id)
+        device = self.network_devices[-1]
+        self.client.post(
+            "/collector/api/v1/device-follow/",
+            {"telegram_user_id": account.telegram_user_id, "device_id": device.id, "is_follow": True},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {self.token.key}",
+        )
+        response = self.get_network_devices(
+            account.telegram_user_id, HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(response.status_code, 200)
+        followed = {device["id"] for device in response.json()["devices"] if device["is_followed_by_user"]}
+        self.assertIn(device.id, followed)
+        other_response = self.get_network_devices(
+            self.accounts[1].telegram_user_id, HTTP_IF_NONE_MATCH=other_response["ETag"],
+        )
+        self.assertEqual(other_response.status_code, 304)
+
+    def test_device_protocols(self):
+        with self.assertMaxQueries(2):
+            response = self.client.generic(
+                "GET", "/collector/api/v1/device-protocols/",
+                data=f'{{"network_ssid": "{self.network.ssid}"}}',
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_notify_network_subscribers(self):
+        changed_device_ids = {device.id for device in self.network_devices[:SEED_FOLLOWED_DEVICES]}
+        with mock.patch("collector.utils.dispatcher") as dispatcher:
+            with self.assertMaxQueries(2):
+                notify_network_subscribers(self.network.ssid, changed_device_ids)
+        self.assertEqual(dispatcher.enqueue.call_count, SEED_ACCOUNTS)
+
+
+class IndexUsageTest(SeededTestCase):
+
+    def test_active_network_devices(self):
+        devices = Device.objects.filter(sessions__network=self.network, sessions__status="A")
+        self.assertIndexUsed(devices, "session_status_network_idx")
+
+    def test_active_sessions_of_devices(self):
+        sessions = Session.objects.filter(device__in=self.network_devices[:100], status="A")
+        self.assertIndexUsed(sessions, "session_device_status_idx")
+
+    def test_network_devices(self):
+        self.assertIndexUsed(get_network_devices(self.network.ssid), "session_status_network_idx")
+
+    def test_network_messages_of_account(self):
+        messages = TelegramMessage.objects.filter(
+            telegram_account=self.accounts[0], network=self.network,
+        )
+        self.assertIndexUsed(messages, "message_account_network_idx")
+
+
+class CachedTokenAuthenticationTest(SeededTestCase):
+
+    def get_followed_devices(self, token_key):
+        return self.client.generic(
+            "GET", "/collector/api/v1/manage-network-devices/",
+            data=f'{{"network_ssid": "{self.network.ssid}", "telegram_user_id": 0}}',
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {token_key}",
+        )
+
+    def assertNoTokenQueries(self, context):
+        queries = [query["sql"] for query in context.captured_queries if "authtoken_token" in query["sql"]]
+        self.assertEqual(queries, [])
+
+    def test_token_is_cached(self):
+        response = self.get_followed_devices(self.token.key)
+        self.assertEqual(response.status_code, 200, response.content)
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_followed_devices(self.token.key)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertNoTokenQueries(context)
+
+    def test_deleted_token_is_rejected(self):
+        token = Token.objects.create(user=User.objects.create(username="rotated"))
+        self.assertEqual(self.get_followed_devices(token.key).status_code, 200)
+        token.delete()
+        self.assertEqual(self.get_followed_devices(token.key).status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        user = User.objects.create(username="deactivated")
+        token = Token.objects.create(user=user)
+        self.assertEqual(self.get_followed_devices(token.key).status_code, 200)
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.get_followed_devices(token.key).status_code, 401)
+
+    def test_telegram_account_uses_authenticated_user(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                "/collector/api/v1/telegram-account/",
+                {"telegram_user_id": 100, "nickname": "new", "chat": 100},
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Token {self.token.key}",
+            )
+        self.assertEqual(response.json(), {"account_status": "created"})
+        self.assertEqual(TelegramAccount.objects.get(telegram_user_id=100).owner, self.user)
+        self.assertEqual(
+            len([query for query in context.captured_queries if "authtoken_token" in query["sql"]]), 1,
+        )
+
+
+class NotificationDispatcherTest(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch("collector.notifications.requests.post")
+        self.post = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.post.return_value = mock.Mock(ok=True)
+
+    def create_dispatcher(self, **kwargs):
+        dispatcher = NotificationDispatcher(workers=1, retry_delay=0, **kwargs)
+        self.addCleanup(lambda: dispatcher.executor.shutdown(wait=True))
+        return dispatcher
+
+    def wait_for(self, dispatcher):
+        # a single worker runs tasks in order
+        dispatcher.executor.submit(lambda: None).result()
+
+    def test_updates_within_debounce_window_are_delayed(self):
+        dispatcher = self.create_dispatcher(debounce=0.3)
+        dispatcher.enqueue(1, "home")
+        self.wait_for(dispatcher)
+        self.assertEqual(self.post.call_count, 1)
+
+        dispatcher.enqueue(1, "home")
+        dispatcher.enqueue(1, "home")
+        dispatcher.enqueue(2, "home")
+        self.wait_for(dispatcher)
+        self.assertEqual(self.post.call_count, 2)
+
+        time.sleep(0.5)
+        self.wait_for(dispatcher)
+        self.assertEqual(self.post.call_count, 3)
+
+    def test_failed_delivery_is_retried(self):
+        dispatcher = self.create_dispatcher(max_attempts=3)
+        self.post.side_effect = [RequestException("timeout"), mock.Mock(ok=False), mock.Mock(ok=True)]
+        dispatcher._deliver(1, "home")
+        self.assertEqual(self.post.call_count, 3)
+
+    def test_delivery_is_dropped_after_max_attempts(self):
+        dispatcher = self.create_dispatcher(max_attempts=2)
+        self.post.side_effect = RequestException("timeout")
+        dispatcher._deliver(1, "home")
+        self.assertEqual(self.post.call_count, 2)
+
+    def test_sent_times_outside_debounce_window_are_pruned(self):
+        dispatcher = self.create_dispatcher(debounce=0)
+        for chat_id in range(100):
+            dispatcher._deliver(chat_id, "home")
+        self.assertEqual(len(dispatcher._last_sent), 1)
+
+
+class RequestMetricsTest(TestCase):
+
+    def test_metrics_endpoint_reports_views(self):
+        self.client.generic(
+            "GET", "/collector/api/v1/device-protocols/",
+            data='{"network_ssid": "home"}', content_type="application/json",
+        )
+        response = self.client.get("/collector/api/v1/metrics/")
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertIn('collector_request_queries_count{method="GET",view="device_protocols"}', metrics)
+        self.assertIn('collector_request_render_seconds_count{method="GET",view="device_protocols"}', metrics)
+
+    def test_slow_request_over_budget_is_traced(self):
+
+        def view(request):
+            Network.objects.count()
+            Network.objects.count()
+            return HttpResponse()
+
+        with tempfile.NamedTemporaryFile("r") as trace_file:
+            middleware = RequestMetricsMiddleware(
+                view, query_budget=1, slow_request_seconds=0, trace_rate=1, trace_file=trace_file.name,
+            )
+            middleware(RequestFactory().get("/slow/"))
+            trace = json.loads(trace_file.readline())
+
+        self.assertEqual(trace["path"], "/slow/")
+        self.assertEqual(trace["queries"], 2)
+        self.assertEqual(len(trace["sql"]), 2)
+        self.assertIn('collector_requests_over_query_budget_total{method="GET",view="unresolved"}',
+                      "\n".join(REQUESTS_OVER_BUDGET.render()))
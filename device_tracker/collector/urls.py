@@ -5,8 +5,10 @@ from collector.views import (
     TelegramAccountView,
     SubscribeNetworkView,
     NetworkDevicesView,
+    DeviceProtocolsView,
     RegisterMessageView,
     DeviceFollowView,
+    MetricsView,
 )
 
 
@@ -16,6 +18,8 @@ urlpatterns = [
     path("telegram-account/", TelegramAccountView.as_view(), name="telegram_account"),
     path("subscribe-network/", SubscribeNetworkView.as_view(), name="subscribe_network"),
     path("manage-network-devices/", NetworkDevicesView.as_view(), name="network_devices"),
+    path("device-protocols/", DeviceProtocolsView.as_view(), name="device_protocols"),
     path("register-message/", RegisterMessageView.as_view(), name="register_message"),
     path("device-follow/", DeviceFollowView.as_view(), name="device_follow"),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
 ]
@@ -1,16 +1,14 @@
+from collections import defaultdict
 from string import ascii_uppercase, digits
 from random import choices
 from datetime import datetime
 
-import requests
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import F
+from django.db import transaction
+from django.db.models import Max
 from django.utils import timezone
 
-from collector.constants import (
-    NETWORK_KEY_LENGTH,
-    UPDATE_NETWORK_STATUS_ENDPOINT,
-)
+from collector.constants import NETWORK_KEY_LENGTH
 from collector.models import (
     Network,
     Device,
@@ -18,51 +16,83 @@ from collector.models import (
     TelegramAccount,
     TelegramChat,
     TelegramMessage,
+    PingerSequence,
 )
+from collector.notifications import dispatcher
 
 
-def get_or_create_device(mac_addr, ipv4):
-
-    try:
-        device = Device.objects.get(mac_addr=mac_addr)
-        device.ipv4 = ipv4
-        device.save()
-    except ObjectDoesNotExist:
-        device = Device.objects.create(mac_addr=mac_addr, ipv4=ipv4)
-        print(f"new device was created: {device}")
-
-    return device
-
-
-def maintain_device_sessions(ssid, device):
+def ingest_device_sessions(ssid, devices_data, network=None) -> dict:
+    # fixed number of statements for any batch size:
+    # upsert devices, close sessions in other networks, create missing sessions;
+    # returns ids of devices which joined or left a network grouped by its ssid
+    changes = defaultdict(set)
     now = datetime.now(tz=timezone.utc)
-    network = Network.objects.get(ssid=ssid)
-
-    active_sessions = device.sessions.filter(status="A")
-    active_sessions.exclude(network=network).update(end=now, status="F")
-
-    try:
-        active_session_current_ssid = active_sessions.get(network=network)
-        print(f"{device} has active session for `{ssid}`: {active_session_current_ssid}")
-    except ObjectDoesNotExist:
-        session_data = {"network": network, "device": device}
-        active_session_current_ssid = Session.objects.create(**session_data)
-        print(f"session for device:{device} in network:{network} "
-              f"was created:{active_session_current_ssid}")
+    if network is None:
+        network = Network.objects.get(ssid=ssid)
+    ipv4_by_mac = {
+        data["device_mac_addr"]: data["device_ipv4_addr"] for data in devices_data
+    }
+
+    with transaction.atomic():
+        Device.objects.bulk_create(
+            [Device(mac_addr=mac_addr, ipv4=ipv4) for mac_addr, ipv4 in ipv4_by_mac.items()],
+            update_conflicts=True,
+            unique_fields=["mac_addr"],
+            update_fields=["ipv4", "last_modified"],
+        )
+        devices = Device.objects.filter(mac_addr__in=ipv4_by_mac)
 
+        foreign_sessions = (
+            Session.objects.filter(device__in=devices, status="A").exclude(network=network)
+        )
+        for foreign_ssid, device_id in foreign_sessions.values_list("network__ssid", "device_id"):
+            changes[foreign_ssid].add(device_id)
+        foreign_sessions.update(end=now, status="F")
+
+        devices_with_session = Session.objects.filter(
+            device__in=devices,
+            network=network,
+            status="A",
+        ).values("device_id")
+        new_session_device_ids = list(
+            devices.exclude(id__in=devices_with_session).values_list("id", flat=True)
+        )
+        Session.objects.bulk_create(
+            [Session(network=network, device_id=device_id) for device_id in new_session_device_ids]
+        )
+        changes[ssid].update(new_session_device_ids)
 
-def maintain_missed_pings(ssid: str, live_mac_addresses: list):
-    network = Network.objects.get(ssid=ssid)
-    query = {"sessions__network": network, "sessions__status": "A"}
-    devices = Device.objects.filter(**query)
+    print(f"{len(ipv4_by_mac)} devices ingested for `{ssid}`, "
+          f"{len(new_session_device_ids)} sessions created")
+    return changes
 
-    (devices.exclude(mac_addr__in=live_mac_addresses).
-     update(missed_pings=F("missed_pings") + 1))
 
-    devices.filter(mac_addr__in=live_mac_addresses).update(missed_pings=0)
-    lost_devices = devices.filter(missed_pings__gt=F("missed_pings_threshold"))
-    Session.objects.filter(device__in=lost_devices).update(status="C")
-    lost_devices.update(missed_pings=0)
+def accept_pinger_batch(pinger_id, ssid, sequence, network=None) -> bool:
+    # the high-water mark only moves forward, a batch which does not move it
+    # was processed already or is older than a processed one
+    now = datetime.now(tz=timezone.utc)
+    updated = (
+        PingerSequence.objects.
+        filter(pinger_id=pinger_id, network__ssid=ssid, sequence__lt=sequence).
+        update(sequence=sequence, last_modified=now)
+    )
+    if updated:
+        return True
+
+    _, created = PingerSequence.objects.get_or_create(
+        pinger_id=pinger_id,
+        network=network or Network.objects.get(ssid=ssid),
+        defaults={"sequence": sequence},
+    )
+    return created
+
+
+def get_pinger_sequence(pinger_id):
+    return (
+        PingerSequence.objects.
+        filter(pinger_id=pinger_id).
+        aggregate(sequence=Max("sequence"))["sequence"]
+    )
 
 
 def verify_telegram_account(data, user):
@@ -103,31 +133,45 @@ def get_network_key():
     return key
 
 
-def notify_network_subscribers(ssid):
-    network = Network.objects.get(ssid=ssid)
-    subscribed_telegram_accounts = network.subscribers
-    print(f"network: {network} has subscribers: {subscribed_telegram_accounts.all()}")
-    for subscribed_telegram_account in subscribed_telegram_accounts.all():
-        subscribed_devices = subscribed_telegram_account.devices_to_track.filter(
-            sessions__network__ssid=ssid,
-            sessions__status="A",
-        )
-        print(f"{subscribed_telegram_account} subscribed for devices: {subscribed_devices}")
+def notify_network_subscribers(ssid, device_ids):
+    # only chats of subscribers who follow one of the changed devices
+    telegram_messages = TelegramMessage.objects.filter(
+        network__ssid=ssid,
+        telegram_account__networks_to_track__ssid=ssid,
+        telegram_account__devices_to_track__in=device_ids,
+    ).select_related("telegram_chat").distinct()
+    print(f"network: {ssid} changed devices: {device_ids} messages to update: {telegram_messages}")
 
-        if subscribed_devices.exists():
-            telegram_messages = TelegramMessage.objects.filter(
-                telegram_account=subscribed_telegram_account,
-                network=network,
-            )
-            print(f"{subscribed_telegram_account} has {network} messages: {telegram_messages}")
-            for msg in telegram_messages:
-                notify(msg.telegram_chat.telegram_chat_id, ssid)
+    for msg in telegram_messages:
+        notify(msg.telegram_chat.telegram_chat_id, ssid)
 
 
 def notify(chat_id, network_ssid):
-    data = {"chat_id": chat_id, "network_ssid": network_ssid}
-    response = requests.post(url=UPDATE_NETWORK_STATUS_ENDPOINT, json=data)
-    print(f"{UPDATE_NETWORK_STATUS_ENDPOINT} response: {response}")
+    dispatcher.enqueue(chat_id, network_ssid)
+
+
+def notify_network_subscribers_on_commit(changes: dict):
+    # subscribers are resolved and notified by the dispatcher workers
+    # once the presence state is committed
+    for ssid, device_ids in changes.items():
+        if not device_ids:
+            continue
+        transaction.on_commit(
+            lambda ssid=ssid, device_ids=set(device_ids):
+            dispatcher.submit(notify_network_subscribers, ssid, device_ids)
+        )
+
+
+def get_network_devices(ssid):
+    return Device.objects.filter(sessions__status="A", sessions__network__ssid=ssid).distinct()
+
+
+def get_followed_device_ids(telegram_id) -> set:
+    return set(
+        TelegramAccount.devices_to_track.through.objects.
+        filter(telegramaccount__telegram_user_id=telegram_id).
+        values_list("device_id", flat=True)
+    )
 
 
 def get_telegram_msg_for_network(telegram_id, network_ssid):
@@ -1,7 +1,8 @@
+from collections import defaultdict
+
 from django.core.exceptions import ObjectDoesNotExist
+from django.http import HttpResponse
 from rest_framework import status
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.authtoken.models import Token
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.request import Request
 from rest_framework.response import Response
@@ -15,19 +16,33 @@ from collector.models import (
 from collector.serializers import (
     NetworkSerializer,
     UpdateCreateSessionSerializer,
+    DeviceSessionsDeltaSerializer,
     TelegramAccountSerializer,
     NetworkDevicesSerializer,
+    DeviceProtocolSerializer,
     RegisterMessageSerializer,
     DeviceFollowSerializer,
 )
 from collector.utils import (
-    get_or_create_device,
-    maintain_device_sessions,
-    maintain_missed_pings,
-    notify_network_subscribers,
+    notify_network_subscribers_on_commit,
     verify_telegram_account,
+    accept_pinger_batch,
+    get_pinger_sequence,
+    get_network_devices,
+    get_followed_device_ids,
     get_telegram_msg_for_network,
 )
+from collector.authentication import CachedTokenAuthentication
+from collector.constants import PINGER_ID_HEADER, PINGER_SEQUENCE_HEADER
+from collector.metrics import REGISTRY, PROMETHEUS_CONTENT_TYPE
+from collector.presence import presence
+from collector.caching import (
+    get_version,
+    get_or_build,
+    network_devices_key,
+    followed_devices_key,
+    invalidate_network_devices_on_commit,
+)
 
 
 class NetworkView(APIView):
@@ -47,36 +62,122 @@ class UpdateCreateSessionView(APIView):
 
     def post(self, request: Request):
         print(f"Request: {request.data}")
+        sequence = request.headers.get(PINGER_SEQUENCE_HEADER)
+        if sequence is not None and not sequence.isdigit():
+            data = {PINGER_SEQUENCE_HEADER: ["A valid integer is required."]}
+            return Response(data=data, status=status.HTTP_400_BAD_REQUEST)
+
+        if isinstance(request.data, dict) and request.data.get("mode") == "delta":
+            return self.post_delta(request)
+
         serializer = UpdateCreateSessionSerializer(data=request.data, many=True)
 
         if serializer.is_valid():
-            live_mac_addresses = []
-            ssid = ""
-
+            # a gateway may report several networks in one batch
+            devices_by_ssid = defaultdict(list)
             for data in serializer.data:
-                mac_addr = data.get("device_mac_addr")
-                ipv4 = data.get("device_ipv4_addr")
-                ssid = data.get("network_ssid")
+                devices_by_ssid[data["network_ssid"]].append(data)
 
-                device = get_or_create_device(mac_addr, ipv4)
-                maintain_device_sessions(ssid, device)
-                live_mac_addresses.append(mac_addr)
+            # networks observed before a failing one are reset by presence
+            # as the whole batch is rolled back
+            is_accepted = presence.run(self.ingest_snapshot, request, serializer.networks, devices_by_ssid)
+            if devices_by_ssid and not is_accepted:
+                return self.duplicate_response(request)
+            return Response(data=serializer.data, status=status.HTTP_200_OK)
+        else:
+            return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-            maintain_missed_pings(ssid, live_mac_addresses)
-            notify_network_subscribers(ssid)
+    def ingest_snapshot(self, request: Request, networks, devices_by_ssid) -> bool:
+        changes = defaultdict(set)
+        is_accepted = False
+        for ssid, devices_data in devices_by_ssid.items():
+            network = networks[ssid]
+            if not self.accept_batch(request, ssid, network=network):
+                continue
+            is_accepted = True
+            for changed_ssid, device_ids in presence.observe_snapshot(
+                ssid, devices_data, network_object=network,
+            ).items():
+                changes[changed_ssid].update(device_ids)
+
+        invalidate_network_devices_on_commit(changes)
+        notify_network_subscribers_on_commit(changes)
+        return is_accepted
+
+    def post_delta(self, request: Request):
+        serializer = DeviceSessionsDeltaSerializer(data=request.data)
 
-            return Response(data=serializer.data, status=status.HTTP_200_OK)
+        if serializer.is_valid():
+            ssid = serializer.validated_data["network_ssid"]
+            appeared = serializer.validated_data["appeared"]
+            changed = serializer.validated_data["changed"]
+            disappeared = serializer.validated_data["disappeared"]
+            live_devices = serializer.validated_data["heartbeat"]["live_devices"]
+            partial = serializer.validated_data["partial"]
+            scanned = serializer.validated_data["scanned"]
+            complete = serializer.validated_data["complete"]
+
+            resync = presence.run(
+                self.ingest_delta,
+                request,
+                ssid=ssid,
+                appeared=appeared,
+                changed=changed,
+                disappeared=disappeared,
+                live_devices=live_devices,
+                partial=partial,
+                scanned=scanned,
+                complete=complete,
+            )
+            if resync is None:
+                return self.duplicate_response(request)
+
+            data = {
+                "appeared": len(appeared),
+                "changed": len(changed),
+                "disappeared": len(disappeared),
+                "resync": resync,
+                "partial": partial,
+            }
+            return Response(data=data, status=status.HTTP_200_OK)
         else:
             return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def ingest_delta(self, request: Request, ssid, **delta):
+        if not self.accept_batch(request, ssid):
+            return None
+        changes, resync = presence.observe_delta(ssid=ssid, **delta)
+        invalidate_network_devices_on_commit(changes)
+        notify_network_subscribers_on_commit(changes)
+        return resync
+
+    @staticmethod
+    def accept_batch(request: Request, ssid, network=None) -> bool:
+        # batches of pingers which do not send a sequence are always processed
+        pinger_id = request.headers.get(PINGER_ID_HEADER)
+        sequence = request.headers.get(PINGER_SEQUENCE_HEADER)
+        if pinger_id is None or sequence is None:
+            return True
+
+        if accept_pinger_batch(pinger_id, ssid, int(sequence), network=network):
+            return True
+        print(f"batch {sequence} of pinger `{pinger_id}` for `{ssid}` was already processed")
+        return False
+
+    @staticmethod
+    def duplicate_response(request: Request):
+        # the high-water mark tells a pinger whose sequence went back
+        # (e.g. the clock stepped back over a restart) where to go on from
+        sequence = get_pinger_sequence(request.headers.get(PINGER_ID_HEADER))
+        return Response(data={"duplicate": True, "sequence": sequence}, status=status.HTTP_200_OK)
+
 
 class TelegramAccountView(APIView):
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request: Request):
-
-        user = Token.objects.get(key=request.auth.key).user
+        user = request.user
         print(f"user was found: {user}")
         serializer = TelegramAccountSerializer(data=request.data)
         if serializer.is_valid():
@@ -89,7 +190,7 @@ class TelegramAccountView(APIView):
 
 class SubscribeNetworkView(APIView):
 
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request: Request):
@@ -110,29 +211,60 @@ class SubscribeNetworkView(APIView):
 
 
 class NetworkDevicesView(APIView):
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request: Request):
         print(f"NetworkDevicesView request data: {request.data}")
         ssid = request.data.get("network_ssid")
         telegram_id = request.data.get("telegram_user_id")
-        devices = (
-            Device.objects.filter(sessions__status="A", sessions__network__ssid=ssid)
-        )
-        print(f"NetworkDevicesView found devices: {devices}")
-        context = {"telegram_id": telegram_id}
+        # the device list of a network and the followed devices of an account
+        # are cached separately, both are invalidated by bumping their version
+        network_version = get_version(network_devices_key(ssid))
+        followed_version = get_version(followed_devices_key(telegram_id))
         telegram_msg_id = get_telegram_msg_for_network(
             telegram_id=telegram_id,
             network_ssid=ssid
         )
-        serializer = NetworkDevicesSerializer(devices, many=True, context=context)
-        data = {"devices": serializer.data, "telegram_msg_id": telegram_msg_id}
+        etag = f'"{network_version}-{followed_version}-{telegram_msg_id}"'
+        headers = {"ETag": etag}
+        if etag in request.headers.get("If-None-Match", ""):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        devices = get_or_build(
+            network_devices_key(ssid),
+            network_version,
+            lambda: NetworkDevicesSerializer(get_network_devices(ssid), many=True).data,
+        )
+        followed_device_ids = get_or_build(
+            followed_devices_key(telegram_id),
+            followed_version,
+            lambda: get_followed_device_ids(telegram_id),
+        )
+        print(f"NetworkDevicesView found devices: {devices}")
+        devices = [
+            {**device, "is_followed_by_user": device["id"] in followed_device_ids}
+            for device in devices
+        ]
+        data = {"devices": devices, "telegram_msg_id": telegram_msg_id}
+        return Response(data=data, status=status.HTTP_200_OK, headers=headers)
+
+
+class DeviceProtocolsView(APIView):
+
+    def get(self, request: Request):
+        ssid = request.data.get("network_ssid")
+        devices = (
+            Device.objects.filter(use_tcp=True, sessions__network__ssid=ssid).distinct()
+        )
+        print(f"DeviceProtocolsView found TCP devices: {devices}")
+        serializer = DeviceProtocolSerializer(devices, many=True)
+        data = {"devices": serializer.data}
         return Response(data=data, status=status.HTTP_200_OK)
 
 
 class RegisterMessageView(APIView):
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request: Request):
@@ -145,7 +277,7 @@ class RegisterMessageView(APIView):
 
 
 class DeviceFollowView(APIView):
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request: Request):
@@ -155,3 +287,9 @@ class DeviceFollowView(APIView):
             return Response(data=serializer.data, status=status.HTTP_200_OK)
         else:
             return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class MetricsView(APIView):
+
+    def get(self, request: Request):
+        return HttpResponse(REGISTRY.render(), content_type=PROMETHEUS_CONTENT_TYPE)
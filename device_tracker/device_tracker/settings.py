@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "collector.middleware.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -77,6 +78,11 @@ WSGI_APPLICATION = "device_tracker.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# SQLite allows a single writer: an ingestion transaction reads before it
+# writes and fails with "database is locked" when another batch writes at the
+# same time, such a batch is retried PRESENCE_LOCK_RETRIES times, concurrent
+# pingers under load need a server database
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
@@ -85,6 +91,19 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# in-process cache, several server processes need a shared backend to see
+# each other's invalidations
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -0,0 +1,74 @@
+from ipaddress import IPv4Network
+from typing import Union
+
+import scapy.all as scapy
+from scapy.layers.l2 import ARP, Ether
+from scapy.plist import SndRcvList, PacketList, QueryAnswer
+
+BROADCAST_MAC_ADDR = "ff:ff:ff:ff:ff:ff"
+
+
+def get_mac(ip):
+
+    # Create ARP packet object.
+    # pdst - destination host ip-address
+    arp_request = ARP(pdst=ip)
+
+    # Create ethernet packet object.
+    # dst - broadcast MAC address
+    broadcast_request = Ether(dst=BROADCAST_MAC_ADDR)
+
+    # Combine two packets into one (encapsulate)
+    arp_broadcast_request = broadcast_request / arp_request
+
+    data: tuple[SndRcvList, PacketList] = scapy.srp(
+        arp_broadcast_request,
+        timeout=1,
+        verbose=None,
+    )
+
+    print(f"SndRcvList: {data[0]}")
+    print(f"PacketList: {data[1]}")
+
+    # in our case snd_rev_list has only one object inside
+    snd_rev_list = data[0]
+    if len(snd_rev_list) == 0:
+        print(f"warning: can not get MAC for ip:{ip}")
+        return None
+    query_answer: QueryAnswer = snd_rev_list[0]
+    ether: Ether = query_answer.answer
+    print(f"MAC address for {ip}: {ether.hwsrc}")
+    return ether.hwsrc
+
+
+def sweep_mac_addresses(targets: Union[IPv4Network, list], nic=None, timeout=2, pps=None) -> dict:
+    if isinstance(targets, IPv4Network):
+        pdst = str(targets)
+    else:
+        pdst = [str(ip) for ip in targets]
+    if not pdst:
+        return {}
+
+    # scapy expands `pdst` into one ARP request per address, `srp` sends the
+    # whole burst (`inter` sec apart) and collects every reply within
+    # a single `timeout` receive window
+    arp_request = ARP(pdst=pdst)
+    arp_broadcast_request = Ether(dst=BROADCAST_MAC_ADDR) / arp_request
+
+    data: tuple[SndRcvList, PacketList] = scapy.srp(
+        arp_broadcast_request,
+        iface=nic,
+        inter=1 / pps if pps else 0,
+        timeout=timeout,
+        verbose=None,
+    )
+
+    snd_rev_list = data[0]
+    mac_map = {}
+    for query_answer in snd_rev_list:
+        query_answer: QueryAnswer
+        arp_reply: ARP = query_answer.answer[ARP]
+        mac_map[arp_reply.psrc] = arp_reply.hwsrc
+
+    print(f"ARP sweep resolved {len(mac_map)} MAC addresses")
+    return mac_map
@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import time
+from collections import defaultdict
+from ipaddress import IPv4Network
+from types import SimpleNamespace
+
+from scapy.layers.l2 import ARP
+
+import arp
+import pinger
+from mac_resolver import MacResolver
+
+BENCH_SSID = "benchmark"
+BENCH_NIC = "sim0"
+
+
+class SimulatedNetwork:
+
+    def __init__(self, network, hosts, latency, jitter, loss, seed=None):
+        self.network = IPv4Network(network)
+        self.nic_ip = str(self.network.network_address + 1)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.probes = 0
+
+        addresses = [str(ip) for ip in self.network.hosts() if str(ip) != self.nic_ip]
+        self.hosts = {
+            ip: "02:00:%02x:%02x:%02x:%02x" % tuple(int(octet) for octet in ip.split("."))
+            for ip in self.random.sample(addresses, min(hosts, len(addresses)))
+        }
+
+    def get_latency(self):
+        return max(0.0, self.random.gauss(self.latency, self.jitter))
+
+    def answers(self, ip):
+        self.probes += 1
+        return ip in self.hosts and self.random.random() >= self.loss
+
+    # pythonping.ping replacement
+    def ping(self, target, timeout, interval, count, **kwargs):
+        responses = []
+        for attempt in range(count):
+            if attempt:
+                time.sleep(interval)
+            if self.answers(target):
+                latency = self.get_latency()
+                time.sleep(latency)
+                message = SimpleNamespace(source=target)
+                responses.append(SimpleNamespace(message=message, time_elapsed=latency))
+                break
+            time.sleep(timeout)
+            responses.append(SimpleNamespace(message=None, time_elapsed=timeout))
+
+        is_success = any(response.message for response in responses)
+        return SimpleNamespace(_responses=responses, success=lambda: is_success)
+
+    # scapy.srp replacement
+    def srp(self, packet, timeout=2, inter=0, **kwargs):
+        pdst = packet[ARP].pdst
+        if isinstance(pdst, str):
+            pdst = [str(ip) for ip in IPv4Network(pdst, strict=False)] if "/" in pdst else [pdst]
+
+        answered = []
+        for ip in pdst:
+            if inter:
+                time.sleep(inter)
+            if self.answers(ip):
+                reply = SimpleNamespace(psrc=ip, hwsrc=self.hosts[ip])
+                answered.append(SimpleNamespace(answer=SimulatedArpAnswer(reply)))
+        time.sleep(timeout)
+        return answered, []
+
+    # sender.send_data replacement
+    def send_data(self, url, data, headers=None, http_method="post"):
+        body = {"devices": []} if "device-protocols" in url else data
+        return SimpleNamespace(ok=True, status_code=200, text="", json=lambda: body)
+
+
+class SimulatedArpAnswer:
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.hwsrc = reply.hwsrc
+
+    def __getitem__(self, layer):
+        return self.reply
+
+
+def create_simulated_scanner(network: SimulatedNetwork):
+
+    class SimulatedIcmpScanner:
+
+        def __init__(self, count, timeout, interval):
+            self.count = count
+            self.timeout = timeout
+            self.interval = interval
+            self.timeouts = 0
+            self.errors = 0
+
+        async def scan(self, targets, pacer=None, deadline=None) -> dict:
+            rtts = {}
+            probes = []
+            for ip in targets:
+                if deadline is not None and time.perf_counter() + self.timeout >= deadline:
+                    break
+                if pacer is not None:
+                    await pacer.async_wait()
+                rtts[ip] = []
+                probes.append(asyncio.ensure_future(self.probe(ip, rtts[ip])))
+            await asyncio.gather(*probes)
+            return rtts
+
+        async def probe(self, ip, host_rtts):
+            for attempt in range(self.count):
+                if attempt:
+                    await asyncio.sleep(self.interval)
+                if network.answers(ip):
+                    latency = network.get_latency()
+                    await asyncio.sleep(latency)
+                    host_rtts.append(latency)
+                    return
+                self.timeouts += 1
+            await asyncio.sleep(self.timeout)
+
+    return SimulatedIcmpScanner
+
+
+def timed(phases, phase, func):
+
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            phases[phase] += time.perf_counter() - start_time
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def simulated(network: SimulatedNetwork, phases):
+    patches = [
+        (pinger, "ping", network.ping),
+        (pinger, "send_data", timed(phases, "send", network.send_data)),
+        (pinger, "IcmpScanner", create_simulated_scanner(network)),
+        (pinger, "get_nic_ip_address", lambda nic: network.nic_ip),
+        (pinger, "get_nic_prefix", lambda nic: network.network.prefixlen),
+        (pinger, "sweep_mac_addresses", timed(phases, "mac", arp.sweep_mac_addresses)),
+        (pinger, "get_mac", timed(phases, "mac", arp.get_mac)),
+        (pinger, "prepare_data_to_send", timed(phases, "prepare", pinger.prepare_data_to_send)),
+        (arp, "scapy", SimpleNamespace(srp=network.srp)),
+        (pinger, "SCAN_ENGINES", {
+            engine: timed(phases, "scan", scan)
+            for engine, scan in pinger.SCAN_ENGINES.items()
+        }),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    for module, name, value in patches:
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
+
+
+def run_benchmark(engine, mac_resolver, args):
+    network = SimulatedNetwork(
+        network=args.network,
+        hosts=args.hosts,
+        latency=args.latency,
+        jitter=args.jitter,
+        loss=args.loss,
+        seed=args.seed,
+    )
+    phases = defaultdict(float)
+    mac_cache = MacResolver(nic=BENCH_NIC)
+    mac_cache.resolve_many = timed(phases, "mac", mac_cache.resolve_many)
+    pinger_kwargs = {
+        "count": args.count,
+        "timeout": args.timeout,
+        "interval": args.interval,
+        "threads": args.threads,
+        "ssid": BENCH_SSID,
+        "nic": BENCH_NIC,
+        "mac_resolver": mac_resolver,
+        "engine": engine,
+        "prefix": None,
+        "pps": args.pps,
+        "mac_cache": mac_cache,
+        "tcp_ports": (),
+    }
+
+    with simulated(network, phases), contextlib.redirect_stdout(io.StringIO()):
+        start_time = time.perf_counter()
+        pinger.run_pinger(**pinger_kwargs)
+        total = time.perf_counter() - start_time
+
+    return {
+        "engine": engine,
+        "mac_resolver": mac_resolver,
+        "total": total,
+        "scan": phases["scan"],
+        "mac": phases["mac"],
+        "send": phases["send"],
+        "probes": network.probes,
+        "probes_per_sec": network.probes / total if total else 0,
+    }
+
+
+def print_results(results):
+    header = f"{'engine':<8}{'mac':<10}{'total,s':>10}{'scan,s':>10}{'mac,s':>10}" \
+             f"{'send,s':>10}{'probes':>10}{'probes/s':>10}"
+    print(header)
+    for res in results:
+        print(
+            f"{res['engine']:<8}{res['mac_resolver']:<10}{res['total']:>10.2f}"
+            f"{res['scan']:>10.2f}{res['mac']:>10.2f}{res['send']:>10.3f}"
+            f"{res['probes']:>10}{res['probes_per_sec']:>10.1f}"
+        )
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Pinger benchmark on a simulated network")
+    parser.add_argument("--network", type=str, default="10.0.0.0/24")
+    parser.add_argument("--hosts", type=int, default=30, help="Live hosts in the network")
+    parser.add_argument("--latency", type=float, default=0.005, help="Mean RTT, sec")
+    parser.add_argument("--jitter", type=float, default=0.002, help="RTT deviation, sec")
+    parser.add_argument("--loss", type=float, default=0.0, help="Packet loss rate 0..1")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--count", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=2)
+    parser.add_argument("--interval", type=float, default=1)
+    parser.add_argument("--threads", type=int, default=100)
+    parser.add_argument("--pps", type=int, default=pinger.DEFAULT_PPS)
+    parser.add_argument(
+        "--engines",
+        type=lambda value: value.split(","),
+        default=list(pinger.SCAN_ENGINES),
+    )
+    parser.add_argument(
+        "--mac-resolvers",
+        dest="mac_resolvers",
+        type=lambda value: value.split(","),
+        default=["sweep", "host", "neighbor"],
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    results = []
+    for engine in args.engines:
+        for mac_resolver in args.mac_resolvers:
+            print(f"benchmark: engine={engine} mac_resolver={mac_resolver}")
+            results.append(run_benchmark(engine, mac_resolver, args))
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
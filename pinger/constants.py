@@ -0,0 +1,35 @@
+# seconds between two scheduled scan cycles
+SCAN_INTERVAL = 120
+# part of the cycle kept free for MAC resolution and sending the results
+SCAN_RESERVE = 15
+# default probe budget in packets per second
+DEFAULT_PPS = 100
+# every N-th cycle sends a full snapshot instead of a delta
+FULL_SNAPSHOT_EVERY = 30
+# passive mode: a host silent for QUIET_AFTER sec is probed actively,
+# a host silent for FORGET_AFTER sec is dropped from the presence table
+QUIET_AFTER = 120
+FORGET_AFTER = 3600
+# passive mode: the seed ARP sweep sends chunks of this many seconds of probes
+SEED_CHUNK_SECONDS = 10
+# adaptive probing: a live host missing for more than GONE_AFTER cycles goes
+# to exponential backoff, backoff never exceeds MAX_BACKOFF_CYCLES
+GONE_AFTER = 3
+MAX_BACKOFF_CYCLES = 16
+# quick re-probes for live hosts which missed a single echo
+REPROBE_COUNT = 2
+REPROBE_TIMEOUT = 1
+REPROBE_INTERVAL = 0.5
+# seconds a resolved MAC address is trusted without asking again
+MAC_CACHE_TTL = 300
+# TCP probes: ports tried on devices which use TCP instead of ICMP,
+# 62078 is the iPhone sync port which stays open while the phone sleeps
+DEFAULT_TCP_PORTS = "22,80,443,62078"
+TCP_CONNECT_TIMEOUT = 2
+TCP_CONCURRENCY = 256
+# spool: records per segment file, deliveries of a record rejected by the
+# collector, retries of a record on connection errors and 5xx answers
+SPOOL_SEGMENT_RECORDS = 100
+SPOOL_MAX_ATTEMPTS = 5
+SPOOL_MAX_RETRIES = 20
+SPOOL_MAX_BACKOFF = 60
@@ -0,0 +1,32 @@
+from threading import Lock
+
+
+# One scan cycle at a time with an explicit time budget. A cycle that is still
+# running when the next one is due makes the next one skip, addresses which
+# did not fit into the budget are scanned first by the next cycle.
+class ScanCycle:
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.remainder = []
+        self._lock = Lock()
+
+    def run(self, func, **kwargs):
+        if not self._lock.acquire(blocking=False):
+            print("previous scan cycle is still running - cycle skipped")
+            return
+        try:
+            func(cycle=self, **kwargs)
+        finally:
+            self._lock.release()
+
+    def order(self, targets: list) -> list:
+        remainder = set(self.remainder)
+        carried = [ip for ip in targets if ip in remainder]
+        if carried:
+            print(f"{len(carried)} addresses carried over from the previous cycle")
+        return carried + [ip for ip in targets if ip not in remainder]
+
+    def carry(self, targets: list, scanned_ips: list):
+        scanned_ips = set(scanned_ips)
+        self.remainder = [ip for ip in targets if ip not in scanned_ips]
@@ -0,0 +1,72 @@
+from ipaddress import IPv4Address, collapse_addresses
+
+from constants import FULL_SNAPSHOT_EVERY
+
+
+# Keeps the devices last accepted by the collector and turns every new scan
+# into a delta: appeared, IP-changed and disappeared devices plus a heartbeat.
+# A full snapshot is sent on the first cycle, every `full_snapshot_every`
+# cycles and whenever the collector asks for a resync. A partial cycle is
+# always sent as a delta which only covers the scanned addresses, it carries
+# their ranges so the collector counts misses of the devices on them.
+class DeltaReporter:
+
+    def __init__(self, ssid, full_snapshot_every=FULL_SNAPSHOT_EVERY):
+        self.ssid = ssid
+        self.full_snapshot_every = full_snapshot_every
+        self._reported = None
+        self._cycles = 0
+
+    def prepare(self, data: list, scanned_ips=None):
+        state = {device["device_mac_addr"]: device["device_ipv4_addr"] for device in data}
+        is_partial = scanned_ips is not None
+        is_full_snapshot_due = (
+            self._reported is None or self._cycles % self.full_snapshot_every == 0
+        )
+
+        if is_full_snapshot_due and not is_partial:
+            print(f"delta reporter sends full snapshot of {len(data)} devices")
+            return data, state
+
+        reported = self._reported or {}
+        if is_partial:
+            # devices on unscanned addresses keep their reported state
+            scanned_ips = set(scanned_ips)
+            for mac_addr, ipv4 in reported.items():
+                if ipv4 not in scanned_ips:
+                    state.setdefault(mac_addr, ipv4)
+
+        appeared, changed = [], []
+        for mac_addr, ipv4 in state.items():
+            device = {"device_mac_addr": mac_addr, "device_ipv4_addr": ipv4}
+            if mac_addr not in reported:
+                appeared.append(device)
+            elif reported[mac_addr] != ipv4:
+                changed.append(device)
+        disappeared = [mac_addr for mac_addr in reported if mac_addr not in state]
+
+        payload = {
+            "mode": "delta",
+            "network_ssid": self.ssid,
+            "appeared": appeared,
+            "changed": changed,
+            "disappeared": disappeared,
+            "heartbeat": {"live_devices": len(state)},
+            "partial": is_partial,
+        }
+        if is_partial:
+            scanned_ranges = collapse_addresses(IPv4Address(ip) for ip in scanned_ips)
+            payload["scanned"] = [str(scanned_range) for scanned_range in scanned_ranges]
+            # without reported state every live scanned device is listed as appeared
+            payload["complete"] = self._reported is None
+        print(f"delta reporter sends delta: {payload}")
+        return payload, state
+
+    def commit(self, state: dict):
+        self._reported = state
+        self._cycles += 1
+
+    def reset(self):
+        print("delta reporter state reset, next cycle sends full snapshot")
+        self._reported = None
+        self._cycles = 0
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import socket
+import struct
+import time
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+ICMP_HEADER_FORMAT = "!BBHHH"
+ICMP_HEADER_SIZE = struct.calcsize(ICMP_HEADER_FORMAT)
+ECHO_PAYLOAD = b"device-tracker-pinger"
+
+
+def get_checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def build_echo_request(identifier: int, sequence: int, payload: bytes = ECHO_PAYLOAD) -> bytes:
+    header = struct.pack(ICMP_HEADER_FORMAT, ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    checksum = get_checksum(header + payload)
+    header = struct.pack(ICMP_HEADER_FORMAT, ICMP_ECHO_REQUEST, 0, checksum, identifier, sequence)
+    return header + payload
+
+
+def parse_echo_reply(packet: bytes):
+    # raw IPPROTO_ICMP sockets receive the whole IPv4 datagram,
+    # the IHL field gives the IP header size in 32-bit words
+    ip_header_size = (packet[0] & 0x0F) * 4
+    icmp_header = packet[ip_header_size:ip_header_size + ICMP_HEADER_SIZE]
+    if len(icmp_header) < ICMP_HEADER_SIZE:
+        return None
+
+    icmp_type, _, _, identifier, sequence = struct.unpack(ICMP_HEADER_FORMAT, icmp_header)
+    if icmp_type != ICMP_ECHO_REPLY:
+        return None
+    return identifier, sequence
+
+
+# Pings many hosts from one raw ICMP socket driven by an asyncio loop.
+# Every round sends one echo request to each host that has not answered yet,
+# rounds are `interval` seconds apart and at most `count` rounds are sent.
+# Replies are matched by identifier, source address and sequence, so a scan
+# lasts about `(count - 1) * interval + timeout` sec for any number of hosts.
+# With a `pacer` every packet waits for a token, with a `deadline` no new host
+# is probed once its reply could not arrive in time. Only probed hosts are
+# present in the result, so its length is the scan coverage.
+class IcmpScanner:
+
+    def __init__(self, count, timeout, interval):
+        self.count = count
+        self.timeout = timeout
+        self.interval = interval
+        self.identifier = os.getpid() & 0xFFFF
+        self.timeouts = 0
+        self.errors = 0
+        self._pending = {}
+        self._rtts = {}
+
+    async def scan(self, targets, pacer=None, deadline=None) -> dict:
+        loop = asyncio.get_running_loop()
+        self._pending = {}
+        self._rtts = {}
+        targets = [str(ip) for ip in targets]
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        sock.setblocking(False)
+        loop.add_reader(sock.fileno(), self._on_readable, sock)
+
+        try:
+            for sequence in range(self.count):
+                if sequence:
+                    await asyncio.sleep(self.interval)
+                round_targets = targets if sequence == 0 else list(self._rtts)
+                await self._send_round(loop, sock, sequence, round_targets, pacer, deadline)
+
+            await self._wait_replies()
+        finally:
+            loop.remove_reader(sock.fileno())
+            sock.close()
+
+        # whatever is still pending has timed out
+        self.timeouts = len(self._pending)
+        alive = sum(1 for rtts in self._rtts.values() if rtts)
+        print(f"icmp scan of {len(self._rtts)} hosts finished, {alive} hosts answered")
+        return self._rtts
+
+    async def _send_round(self, loop, sock, sequence, targets, pacer, deadline):
+        packet = build_echo_request(self.identifier, sequence)
+        for ip in targets:
+            if self._rtts.get(ip):
+                continue
+            if deadline is not None and time.perf_counter() + self.timeout >= deadline:
+                print(f"scan deadline reached on round {sequence}")
+                return
+            if pacer is not None:
+                await pacer.async_wait()
+            self._rtts.setdefault(ip, [])
+            try:
+                await loop.sock_sendto(sock, packet, (ip, 0))
+            except OSError as e:
+                print(f"error: {e} while pinging: {ip}")
+                self.errors += 1
+                continue
+            self._pending[(ip, sequence)] = time.perf_counter()
+
+    async def _wait_replies(self):
+        deadline = time.perf_counter() + self.timeout
+        while self._pending and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+
+    def _on_readable(self, sock):
+        while True:
+            try:
+                packet, (ip, _) = sock.recvfrom(1024)
+            except (BlockingIOError, InterruptedError):
+                return
+
+            reply = parse_echo_reply(packet)
+            if reply is None:
+                continue
+            identifier, sequence = reply
+            if identifier != self.identifier:
+                continue
+
+            sent_at = self._pending.pop((ip, sequence), None)
+            if sent_at is None:
+                continue
+            rtt = time.perf_counter() - sent_at
+            if rtt > self.timeout:
+                continue
+            self._rtts[ip].append(rtt)
+            # the host is alive, its other probes are not needed
+            for pending_sequence in range(self.count):
+                self._pending.pop((ip, pending_sequence), None)
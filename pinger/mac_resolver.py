@@ -0,0 +1,82 @@
+import time
+from threading import Lock
+
+from arp import get_mac
+from constants import MAC_CACHE_TTL
+from metrics import MAC_LOOKUPS, MAC_CACHE_ENTRIES
+
+PROC_NET_ARP = "/proc/net/arp"
+# /proc/net/arp flags: ATF_COM - the entry is complete (resolved)
+ATF_COM = 0x2
+INCOMPLETE_MAC_ADDR = "00:00:00:00:00:00"
+
+
+def read_neighbor_table(path=PROC_NET_ARP, nic=None) -> dict:
+    # IP address  HW type  Flags  HW address  Mask  Device
+    neighbors = {}
+    try:
+        with open(path) as arp_table:
+            next(arp_table)
+            for line in arp_table:
+                fields = line.split()
+                if len(fields) < 6:
+                    continue
+                ip, _, flags, mac_addr, _, device = fields[:6]
+                if nic is not None and device != nic:
+                    continue
+                if not int(flags, 16) & ATF_COM or mac_addr == INCOMPLETE_MAC_ADDR:
+                    continue
+                neighbors[ip] = mac_addr
+    except (OSError, StopIteration) as e:
+        print(f"error: {e} while reading neighbor table: {path}")
+    return neighbors
+
+
+# MAC resolution with a TTL'd in-process cache. On a miss the kernel neighbor
+# table is read first (it has just resolved every host that answered our
+# ICMP echo), a broadcast ARP request is sent only if the kernel does not
+# know the address either.
+class MacResolver:
+
+    def __init__(self, nic=None, ttl=MAC_CACHE_TTL):
+        self.nic = nic
+        self.ttl = ttl
+        self._cache = {}
+        self._lock = Lock()
+
+    def resolve(self, ip):
+        return self.resolve_many([ip]).get(ip)
+
+    def resolve_many(self, ips) -> dict:
+        # one neighbor table read for the whole batch instead of one per host
+        now = time.monotonic()
+        mac_map = {}
+        unresolved_ips = []
+
+        with self._lock:
+            for ip in ips:
+                cached = self._cache.get(ip)
+                if cached is not None and cached[1] > now:
+                    MAC_LOOKUPS.inc(result="cache")
+                    mac_map[ip] = cached[0]
+                else:
+                    unresolved_ips.append(ip)
+
+        if unresolved_ips:
+            neighbors = read_neighbor_table(nic=self.nic)
+            for ip in unresolved_ips:
+                mac_addr = neighbors.get(ip)
+                is_neighbor = mac_addr is not None
+                if not is_neighbor:
+                    mac_addr = get_mac(ip)
+
+                MAC_LOOKUPS.inc(result="neighbor" if is_neighbor else "arp")
+                if mac_addr is not None:
+                    mac_map[ip] = mac_addr
+                    with self._lock:
+                        self._cache[ip] = (mac_addr, now + self.ttl)
+
+        with self._lock:
+            cached = len(self._cache)
+        MAC_CACHE_ENTRIES.set(cached)
+        return mac_map
@@ -0,0 +1,165 @@
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PHASE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 90, 120, 300)
+RTT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2)
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels)
+    return f"{{{pairs}}}"
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = Lock()
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines += self.render_value(labels, value)
+        return lines
+
+    def render_value(self, labels, value) -> list:
+        return [f"{self.name}{format_labels(labels)} {value}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total, observations = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for index, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value, observations + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def render_value(self, labels, value) -> list:
+        counts, total, observations = value
+        lines = []
+        for bucket, count in zip(self.buckets, counts):
+            bucket_labels = labels + (("le", bucket),)
+            lines.append(f"{self.name}_bucket{format_labels(bucket_labels)} {count}")
+        lines.append(f"{self.name}_bucket{format_labels(labels + (('le', '+Inf'),))} {observations}")
+        lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {observations}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: Metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+PHASE_SECONDS = REGISTRY.register(Histogram(
+    "pinger_phase_seconds", "Duration of scan cycle phases: ping, mac, send", PHASE_BUCKETS,
+))
+CYCLE_SECONDS = REGISTRY.register(Histogram(
+    "pinger_cycle_seconds", "Duration of a whole scan cycle", PHASE_BUCKETS,
+))
+CYCLE_BUDGET_SECONDS = REGISTRY.register(Gauge(
+    "pinger_cycle_budget_seconds", "Time budget of a scan cycle",
+))
+# one pinger process scans one network, a label per host would add
+# a series per bucket for every address of the network
+RTT_SECONDS = REGISTRY.register(Histogram(
+    "pinger_rtt_seconds", "Echo round trip time of the scanned network", RTT_BUCKETS,
+))
+PING_TIMEOUTS = REGISTRY.register(Counter(
+    "pinger_ping_timeouts_total", "Echo requests left without a reply",
+))
+PING_ERRORS = REGISTRY.register(Counter(
+    "pinger_ping_errors_total", "Echo requests which failed to be sent",
+))
+LIVE_DEVICES = REGISTRY.register(Gauge(
+    "pinger_live_devices", "Devices found by the last scan cycle",
+))
+SCAN_COVERAGE = REGISTRY.register(Gauge(
+    "pinger_scan_coverage_ratio", "Part of the network addresses scanned by the last cycle",
+))
+MAC_LOOKUPS = REGISTRY.register(Counter(
+    "pinger_mac_lookups_total", "MAC address lookups by source: cache, neighbor table or ARP request",
+))
+MAC_CACHE_ENTRIES = REGISTRY.register(Gauge(
+    "pinger_mac_cache_entries", "Addresses in the MAC address cache",
+))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"metrics are exposed on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,38 @@
+import asyncio
+import time
+from threading import Lock
+
+
+# Token bucket measured in packets. Callers reserve tokens before sending and
+# sleep for the returned delay, the balance may go negative, so concurrent
+# callers queue up behind each other and probes are spread evenly at `rate`
+# packets per second with bursts no larger than `capacity`.
+class TokenBucket:
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def reserve(self, tokens=1) -> float:
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def wait(self, tokens=1):
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
+
+    async def async_wait(self, tokens=1):
+        delay = self.reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
@@ -1,10 +1,12 @@
 import argparse
+import asyncio
+import socket
 import time
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from threading import Event, Thread
 from ipaddress import IPv4Interface, IPv4Address, IPv4Network
 
-import scapy.all as scapy
 import tzlocal
 from apscheduler.schedulers.background import BackgroundScheduler
 from netifaces import ifaddresses, AF_INET
@@ -12,10 +14,42 @@ from pythonping import ping
 from pythonping.executor import Response as PythonpingResponse
 from pythonping.executor import ResponseList, Message
 from requests import Response as RequestResponse
-from scapy.layers.l2 import ARP, Ether
-from scapy.plist import SndRcvList, PacketList, QueryAnswer
-
-from sender import get_url, send_data
+from requests.exceptions import RequestException
+
+from arp import get_mac, sweep_mac_addresses
+from cycle import ScanCycle
+from constants import (
+    SCAN_INTERVAL,
+    SCAN_RESERVE,
+    DEFAULT_PPS,
+    DEFAULT_TCP_PORTS,
+    QUIET_AFTER,
+    FORGET_AFTER,
+    SEED_CHUNK_SECONDS,
+    REPROBE_COUNT,
+    REPROBE_TIMEOUT,
+    REPROBE_INTERVAL,
+)
+from delta import DeltaReporter
+from icmp_engine import IcmpScanner
+from mac_resolver import MacResolver
+from metrics import (
+    PHASE_SECONDS,
+    CYCLE_SECONDS,
+    CYCLE_BUDGET_SECONDS,
+    RTT_SECONDS,
+    PING_TIMEOUTS,
+    PING_ERRORS,
+    LIVE_DEVICES,
+    SCAN_COVERAGE,
+    start_metrics_server,
+)
+from pacing import TokenBucket
+from probe_planner import ProbePlanner
+from sender import BatchSequence, get_url, get_sequence_ahead, send_data
+from sniffer import PresenceTable, PresenceSniffer
+from spool import Spool
+from tcp_probe import scan_tcp
 
 
 def get_nic_ip_address(nic):
@@ -25,6 +59,14 @@ def get_nic_ip_address(nic):
     return ip
 
 
+def get_nic_prefix(nic):
+    net_iface = ifaddresses(nic)
+    netmask = net_iface[AF_INET][0]['netmask']
+    prefix = IPv4Network(f"0.0.0.0/{netmask}").prefixlen
+    print(f"netmask: {netmask} prefix: {prefix}")
+    return prefix
+
+
 def get_network(ip_addr, prefix=24):
     print(f"getting network for: {ip_addr} with prefix: {prefix}")
     ip_addr_with_prefix = f"{ip_addr}/{prefix}"
@@ -38,53 +80,292 @@ def secure_ping(kwargs):
         try:
             res: ResponseList = ping(**kwargs)
             print(kwargs, res.success())
-            return res
         except OSError as e:
             print(f"error: {e} while pinging: {kwargs}")
+            PING_ERRORS.inc()
             return ResponseList()
 
+        for response in res._responses:
+            response: PythonpingResponse
+            if response.message is None:
+                PING_TIMEOUTS.inc()
+            else:
+                RTT_SECONDS.observe(response.time_elapsed)
+        return res
+
     return func
 
 
-def run_pinger(count, timeout, interval, threads, ssid, nic):
-    print("pinger started")
-    ip_addr = get_nic_ip_address(nic)
-    net: IPv4Network = get_network(ip_addr)
-    management_ips = (
-        IPv4Address(ip_addr),
-        net.broadcast_address,
-        net.network_address)
-    print(f"scanning network {net} exclude {management_ips}")
+def scan_threaded(targets, count, timeout, interval, threads, pacer, deadline):
+    # a thread job is only submitted if all of its probes can be answered
+    job_duration = (count - 1) * interval + timeout
 
     with ThreadPoolExecutor(max_workers=threads) as executor:
-        start_time = time.perf_counter()
         futures = []
-        for ip in net:
-            if ip in management_ips:
-                continue
+        for ip in targets:
+            if time.perf_counter() + job_duration >= deadline:
+                print(f"scan deadline reached after {len(futures)} hosts")
+                break
             kwargs = {
-                "target": str(ip),
+                "target": ip,
                 "timeout": timeout,
                 "interval": interval,
                 "count": count
             }
+            pacer.wait(count)
             func = secure_ping(kwargs)
             futures.append(executor.submit(func))
-            time.sleep(0.1)
 
     all_results = [future.result() for future in futures]
     ok_results = [res for res in all_results if res.success()]
+    return get_responded_ips(ok_results), targets[:len(futures)]
+
+
+def scan_async(targets, count, timeout, interval, threads, pacer, deadline):
+    scanner = IcmpScanner(count=count, timeout=timeout, interval=interval)
+    rtts: dict = asyncio.run(scanner.scan(targets, pacer=pacer, deadline=deadline))
+    PING_TIMEOUTS.inc(scanner.timeouts)
+    PING_ERRORS.inc(scanner.errors)
+    for ip, host_rtts in rtts.items():
+        for rtt in host_rtts:
+            RTT_SECONDS.observe(rtt)
+    live_ips = [ip for ip, host_rtts in rtts.items() if host_rtts]
+    return live_ips, list(rtts)
+
+
+SCAN_ENGINES = {"thread": scan_threaded, "async": scan_async}
+
+
+def scan_adaptive(targets, count, timeout, interval, threads, pacer, deadline, scan, planner):
+    frequent, backoff = planner.plan(targets)
+
+    # known live hosts first with a single echo each
+    live_ips, probed_ips = scan(frequent, 1, timeout, interval, threads, pacer, deadline)
+
+    # a live host which missed its echo is re-probed right away,
+    # so a lost packet is not reported as a missed ping
+    missed_ips = [ip for ip in probed_ips if ip not in live_ips]
+    if missed_ips:
+        print(f"re-probing hosts which missed an echo: {missed_ips}")
+        reprobe_live_ips, _ = scan(
+            missed_ips, REPROBE_COUNT, REPROBE_TIMEOUT, REPROBE_INTERVAL,
+            threads, pacer, deadline,
+        )
+        live_ips += reprobe_live_ips
+
+    backoff_live_ips, backoff_probed_ips = scan(
+        backoff, count, timeout, interval, threads, pacer, deadline
+    )
+    live_ips += backoff_live_ips
+    probed_ips += backoff_probed_ips
+
+    planner.record(probed_ips=probed_ips, live_ips=live_ips)
+    # addresses skipped by the planner are covered by their history
+    planned = set(frequent + backoff)
+    skipped_ips = [ip for ip in targets if ip not in planned]
+    return live_ips, probed_ips + skipped_ips
+
+
+def run_pinger(count, timeout, interval, threads, ssid, nic, mac_resolver, engine, prefix, pps,
+               reporter=None, planner=None, mac_cache=None, tcp_ports=(), cycle=None,
+               spool=None, sequence=None):
+    print(f"pinger started with `{engine}` scan engine")
+    start_time = time.perf_counter()
+    budget = cycle.budget if cycle is not None else SCAN_INTERVAL - SCAN_RESERVE
+    deadline = start_time + budget
+    CYCLE_BUDGET_SECONDS.set(budget)
+
+    ip_addr = get_nic_ip_address(nic)
+    if prefix is None:
+        prefix = get_nic_prefix(nic)
+    net: IPv4Network = get_network(ip_addr, prefix=prefix)
+    management_ips = (
+        IPv4Address(ip_addr),
+        net.broadcast_address,
+        net.network_address)
+    print(f"scanning network {net} exclude {management_ips} at {pps} packets/sec")
+    targets = [str(ip) for ip in net if ip not in management_ips]
+
+    # devices which use TCP are probed with TCP connects instead of ICMP
+    tcp_devices = fetch_tcp_devices(ssid) if tcp_ports else {}
+    tcp_ips = [ip for ip in targets if ip in tcp_devices]
+    targets = [ip for ip in targets if ip not in tcp_devices]
+    if cycle is not None:
+        targets = cycle.order(targets)
+
+    pacer = TokenBucket(rate=pps)
+    scan = SCAN_ENGINES[engine]
+    with PHASE_SECONDS.time(phase="ping"), ThreadPoolExecutor(max_workers=1) as executor:
+        tcp_future = executor.submit(scan_tcp, tcp_ips, tcp_ports, pacer=pacer)
+        if planner is None:
+            live_ips, scanned_ips = scan(
+                targets, count, timeout, interval, threads, pacer, deadline
+            )
+        else:
+            live_ips, scanned_ips = scan_adaptive(
+                targets, count, timeout, interval, threads, pacer, deadline, scan, planner
+            )
+    if cycle is not None:
+        cycle.carry(targets, scanned_ips)
+    live_ips += tcp_future.result()
+    scanned_ips += tcp_ips
+    targets += tcp_ips
 
     interval = time.perf_counter() - start_time
-    print(f"devices was found: {len(ok_results)} it takes {interval} sec")
-    data: list = prepare_data_to_send(ok_results=ok_results, ssid=ssid)
+    print(f"devices was found: {len(live_ips)} it takes {interval} sec")
+    is_partial = len(scanned_ips) < len(targets)
+    coverage = len(scanned_ips) / len(targets) * 100 if targets else 100
+    print(f"scanned {len(scanned_ips)} of {len(targets)} addresses - coverage {coverage:.1f}%")
+    SCAN_COVERAGE.set(coverage / 100)
+
+    with PHASE_SECONDS.time(phase="mac"):
+        mac_map = None
+        if mac_resolver == "sweep":
+            mac_map = sweep_mac_addresses(live_ips, nic=nic, pps=pps)
+        elif mac_resolver == "neighbor":
+            mac_map = mac_cache.resolve_many(live_ips)
+
+        data: list = prepare_data_to_send(live_ips=live_ips, ssid=ssid, mac_map=mac_map)
+    LIVE_DEVICES.set(len(data))
+
+    with PHASE_SECONDS.time(phase="send"):
+        report_devices(
+            data=data,
+            ssid=ssid,
+            reporter=reporter,
+            scanned_ips=scanned_ips if is_partial else None,
+            spool=spool,
+            sequence=sequence,
+        )
+    CYCLE_SECONDS.observe(time.perf_counter() - start_time)
+
+
+def run_presence_cycle(ssid, nic, pps, table: PresenceTable, reporter=None, cycle=None,
+                       spool=None, sequence=None):
+    print("presence cycle started")
+    # hosts silent for too long get one targeted ARP burst,
+    # every answer refreshes their presence table entry
+    quiet_ips = table.quiet_hosts(quiet_after=QUIET_AFTER)
+    if quiet_ips:
+        print(f"probing quiet hosts: {quiet_ips}")
+        mac_map = sweep_mac_addresses(quiet_ips, nic=nic, pps=pps)
+        for ip, mac_addr in mac_map.items():
+            table.update(ip, mac_addr)
+    table.forget_hosts(forget_after=FORGET_AFTER)
+
+    mac_map = table.live_hosts(quiet_after=QUIET_AFTER)
+    print(f"presence table live hosts: {mac_map}")
+    data: list = prepare_data_to_send(live_ips=list(mac_map), ssid=ssid, mac_map=mac_map)
+    report_devices(data=data, ssid=ssid, reporter=reporter, spool=spool, sequence=sequence)
+
+
+def seed_presence_table(table: PresenceTable, targets: list, nic, pps, budget):
+    # the sweep goes in chunks of a few seconds of probes, so hosts show up
+    # in the table while it goes on and it stops once the budget is spent
+    deadline = time.perf_counter() + budget
+    chunk_size = max(1, int(pps * SEED_CHUNK_SECONDS))
+    for start in range(0, len(targets), chunk_size):
+        if time.perf_counter() >= deadline:
+            print(f"presence table seed stopped by the budget after {start} of {len(targets)} addresses")
+            return
+        mac_map = sweep_mac_addresses(targets[start:start + chunk_size], nic=nic, pps=pps)
+        for ip, mac_addr in mac_map.items():
+            table.update(ip, mac_addr)
+    print(f"presence table seeded from {len(targets)} addresses")
+
+
+def schedule_after_seed(job, seeded: Event, **seed_kwargs):
+    # the job is added paused, a cycle on a half seeded table would report
+    # every device not swept yet as missing
+    try:
+        seed_presence_table(**seed_kwargs)
+    finally:
+        seeded.set()
+        job.modify(next_run_time=datetime.now())
+
+
+def catch_up_sequence(res_data, ssid, headers, sequence) -> bool:
+    sequence_ahead = get_sequence_ahead(res_data, headers)
+    if sequence_ahead is None:
+        return False
+    print(f"report of `{ssid}` was skipped by the collector, its sequence is behind {sequence_ahead}")
+    sequence.advance(sequence_ahead)
+    return True
+
+
+def report_devices(data, ssid, reporter=None, scanned_ips=None, spool=None, sequence=None):
     url = get_url(endpoint="device-sessions")
-    res: RequestResponse = send_data(url, data)
-    print(f"Response: {res.json()}")
+    headers = sequence.next_headers() if sequence is not None else None
+
+    if reporter is None:
+        payload = data
+        if scanned_ips is not None:
+            # without reported state a partial cycle lists every live device
+            # of the scanned ranges, the collector counts misses of the rest
+            payload, _ = DeltaReporter(ssid).prepare(data, scanned_ips=scanned_ips)
+        if spool is not None:
+            spool.append(url=url, payload=payload, ssid=ssid, headers=headers)
+            return
+        try:
+            res: RequestResponse = send_data(url, payload, headers=headers)
+            res_data = res.json()
+        except (RequestException, ValueError) as e:
+            print(f"error: {e} while reporting devices of `{ssid}`")
+            return
+        print(f"Response: {res_data}")
+        catch_up_sequence(res_data, ssid, headers, sequence)
+        return
+
+    payload, state = reporter.prepare(data, scanned_ips=scanned_ips)
+    if spool is not None:
+        # the state is committed right away, a dropped record or a resync
+        # answer resets the reporter through the spool failure hook
+        reporter.commit(state)
+        spool.append(url=url, payload=payload, ssid=ssid, headers=headers)
+        return
 
+    try:
+        res: RequestResponse = send_data(url, payload, headers=headers)
+    except RequestException as e:
+        # the collector may or may not have applied the report
+        print(f"error: {e} while reporting devices of `{ssid}`")
+        reporter.reset()
+        return
+
+    if not res.ok:
+        print(f"collector rejected report: {res.status_code} {res.text}")
+        reporter.reset()
+        return
 
-def prepare_data_to_send(ok_results, ssid):
-    data = []
+    try:
+        res_data = res.json()
+    except ValueError:
+        res_data = None
+    print(f"Response: {res_data}")
+    if catch_up_sequence(res_data, ssid, headers, sequence):
+        reporter.reset()
+    elif isinstance(res_data, dict) and res_data.get("resync"):
+        reporter.reset()
+    else:
+        reporter.commit(state)
+
+
+def fetch_tcp_devices(ssid) -> dict:
+    url = get_url(endpoint="device-protocols")
+    try:
+        res: RequestResponse = send_data(url, {"network_ssid": ssid}, http_method="get")
+        devices = res.json().get("devices", [])
+    except (RequestException, ValueError) as e:
+        print(f"error: {e} while fetching device protocols, TCP probes skipped")
+        return {}
+
+    tcp_devices = {device["ipv4"]: device["mac_addr"] for device in devices if device["use_tcp"]}
+    print(f"devices tracked with TCP probes: {tcp_devices}")
+    return tcp_devices
+
+
+def get_responded_ips(ok_results):
+    live_ips = []
 
     for result in ok_results:
         cycle_pings_amount = len(result._responses)
@@ -96,57 +377,38 @@ def prepare_data_to_send(ok_results, ssid):
             message: Message = response.message
             if message is None:
                 continue
-            ip = message.source
-
-            mac_addr = get_mac(ip)
-
-            if mac_addr is None:
-                continue
-
-            device_data = {
-                "network_ssid": ssid,
-                "device_mac_addr": mac_addr,
-                "device_ipv4_addr": ip,
-            }
-
-            data.append(device_data)
+            live_ips.append(message.source)
             break
 
-    print(f"data form prepare_data_to_send: {data}")
-    return data
+    return live_ips
 
 
-def get_mac(ip):
+def prepare_data_to_send(live_ips, ssid, mac_map=None):
+    data = []
 
-    # Create ARP packet object.
-    # pdst - destination host ip-address
-    arp_request = ARP(pdst=ip)
+    for ip in live_ips:
+        if mac_map is None:
+            mac_addr = get_mac(ip)
+        else:
+            mac_addr = mac_map.get(ip)
 
-    # Create ethernet packet object.
-    # dst - broadcast MAC address
-    broadcast_request = Ether(dst="ff:ff:ff:ff:ff:ff")
+        if mac_addr is None:
+            continue
 
-    # Combine two packets into one (encapsulate)
-    arp_broadcast_request = broadcast_request / arp_request
+        device_data = {
+            "network_ssid": ssid,
+            "device_mac_addr": mac_addr,
+            "device_ipv4_addr": ip,
+        }
 
-    data: tuple[SndRcvList, PacketList] = scapy.srp(
-        arp_broadcast_request,
-        timeout=1,
-        verbose=None,
-    )
+        data.append(device_data)
+
+    print(f"data form prepare_data_to_send: {data}")
+    return data
 
-    print(f"SndRcvList: {data[0]}")
-    print(f"PacketList: {data[1]}")
 
-    # in our case snd_rev_list has only one object inside
-    snd_rev_list = data[0]
-    if len(snd_rev_list) == 0:
-        print(f"warning: can not get MAC for ip:{ip}")
-        return None
-    query_answer: QueryAnswer = snd_rev_list[0]
-    ether: Ether = query_answer.answer
-    print(f"MAC address for {ip}: {ether.hwsrc}")
-    return ether.hwsrc
+def parse_ports(value):
+    return [int(port) for port in value.split(",") if port.strip()]
 
 
 def parse_arguments():
@@ -165,42 +427,215 @@ def parse_arguments():
         help="Network Interface Card name",
         required=True,
     )
+    parser.add_argument(
+        "--mac-resolver",
+        type=str,
+        dest="mac_resolver",
+        help="How MAC addresses are resolved: one ARP sweep for all live "
+             "hosts, one ARP request per live host or the kernel neighbor "
+             "table behind a TTL cache",
+        choices=["sweep", "host", "neighbor"],
+        default="sweep",
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        dest="engine",
+        help="ICMP scan engine: thread per host or a single raw socket "
+             "under an asyncio event loop",
+        choices=list(SCAN_ENGINES),
+        default="thread",
+    )
+    parser.add_argument(
+        "--prefix",
+        type=int,
+        dest="prefix",
+        help="Network prefix length, taken from the NIC netmask by default",
+        default=None,
+    )
+    parser.add_argument(
+        "--pps",
+        type=int,
+        dest="pps",
+        help="Probe budget in packets per second",
+        default=DEFAULT_PPS,
+    )
+    parser.add_argument(
+        "--full-snapshots",
+        dest="full_snapshots",
+        help="Send the full list of live devices every cycle instead of deltas",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        dest="mode",
+        help="Active ICMP sweeps every cycle or passive ARP/DHCP/mDNS sniffing "
+             "with targeted probes for quiet hosts",
+        choices=["active", "passive"],
+        default="active",
+    )
+    parser.add_argument(
+        "--adaptive",
+        dest="adaptive",
+        help="Probe live hosts every cycle with a single echo and silent "
+             "addresses with exponential backoff",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--tcp-ports",
+        type=parse_ports,
+        dest="tcp_ports",
+        help="Comma separated ports for devices tracked with TCP probes, "
+             "empty value disables TCP probes",
+        default=parse_ports(DEFAULT_TCP_PORTS),
+    )
+    parser.add_argument(
+        "--budget",
+        type=int,
+        dest="budget",
+        help="Seconds a scan cycle may take before partial results are sent",
+        default=SCAN_INTERVAL - SCAN_RESERVE,
+    )
+    parser.add_argument(
+        "--spool-dir",
+        type=str,
+        dest="spool_dir",
+        help="Directory of the on-disk spool, reports are queued there and "
+             "delivered by a background drainer instead of being sent inline",
+        default=None,
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        dest="metrics_port",
+        help="Expose scan metrics in Prometheus text format on this local port",
+        default=None,
+    )
+    parser.add_argument(
+        "--pinger-id",
+        type=str,
+        dest="pinger_id",
+        help="Pinger id sent with every batch, `<hostname>-<nic>` by default",
+        default=None,
+    )
     return parser.parse_args()
 
 
 def main():
     parser_args = parse_arguments()
-    pinger_kwargs = {
-        "count": 3,
-        "timeout": 2,
-        "interval": 1,
-        "threads": 100,
-        "ssid": parser_args.ssid,
-        "nic": parser_args.nic,
-    }
+    reporter = None if parser_args.full_snapshots else DeltaReporter(parser_args.ssid)
+    sequence = BatchSequence(parser_args.pinger_id or f"{socket.gethostname()}-{parser_args.nic}")
+    sniffer = None
+    seed_kwargs = None
+    seeded = Event()
+    spool = None
+
+    if parser_args.spool_dir is not None:
+
+        def reset_reporter(record):
+            if reporter is not None:
+                reporter.reset()
+
+        spool = Spool(directory=parser_args.spool_dir, on_failure=reset_reporter, sequence=sequence)
+
+    if parser_args.mode == "passive":
+        ip_addr = get_nic_ip_address(parser_args.nic)
+        table = PresenceTable(ignored_ips=[ip_addr])
+        sniffer = PresenceSniffer(nic=parser_args.nic, table=table)
+
+        # one active ARP sweep of the host addresses seeds the table before the
+        # first report, it runs in the background under the cycle budget
+        prefix = parser_args.prefix or get_nic_prefix(parser_args.nic)
+        net: IPv4Network = get_network(ip_addr, prefix=prefix)
+        seed_kwargs = {
+            "table": table,
+            "targets": [str(ip) for ip in net.hosts() if str(ip) != ip_addr],
+            "nic": parser_args.nic,
+            "pps": parser_args.pps,
+            "budget": parser_args.budget,
+        }
+        job_func = run_presence_cycle
+        job_kwargs = {
+            "ssid": parser_args.ssid,
+            "nic": parser_args.nic,
+            "pps": parser_args.pps,
+            "table": table,
+            "reporter": reporter,
+            "spool": spool,
+            "sequence": sequence,
+        }
+    else:
+        job_func = run_pinger
+        job_kwargs = {
+            "count": 3,
+            "timeout": 2,
+            "interval": 1,
+            "threads": 100,
+            "ssid": parser_args.ssid,
+            "nic": parser_args.nic,
+            "mac_resolver": parser_args.mac_resolver,
+            "engine": parser_args.engine,
+            "prefix": parser_args.prefix,
+            "pps": parser_args.pps,
+            "reporter": reporter,
+            "planner": ProbePlanner() if parser_args.adaptive else None,
+            "mac_cache": MacResolver(nic=parser_args.nic),
+            "tcp_ports": parser_args.tcp_ports,
+            "spool": spool,
+            "sequence": sequence,
+        }
+
+    cycle = ScanCycle(budget=parser_args.budget)
     scheduler_kwargs = {
-        "func": run_pinger,
-        "kwargs": pinger_kwargs,
+        "func": cycle.run,
+        "kwargs": {"func": job_func, **job_kwargs},
         "trigger": "interval",
-        "seconds": 120,
-        "next_run_time": datetime.now()
+        "seconds": SCAN_INTERVAL,
+        "next_run_time": None if sniffer is not None else datetime.now(),
+        "max_instances": 1,
+        "coalesce": True,
     }
 
     print("create scheduler")
     scheduler = BackgroundScheduler(timezone=str(tzlocal.get_localzone()))
 
     print("add jobs to the scheduler")
-    scheduler.add_job(**scheduler_kwargs)
+    job = scheduler.add_job(**scheduler_kwargs)
+
+    if parser_args.metrics_port is not None:
+        start_metrics_server(port=parser_args.metrics_port)
 
     print("start scheduler")
     scheduler.start()
+    if sniffer is not None:
+        sniffer.start()
+        Thread(
+            target=schedule_after_seed,
+            kwargs={"job": job, "seeded": seeded, **seed_kwargs},
+            name="presence-seed",
+            daemon=True,
+        ).start()
+    if spool is not None:
+        spool.start()
 
     try:
         while True:
-            time.sleep(3)
+            if sniffer is None:
+                time.sleep(3)
+            elif sniffer.arrived.wait(3):
+                # report new hosts right away instead of waiting for the next tick,
+                # arrivals during the seed are reported by the first cycle
+                sniffer.arrived.clear()
+                if seeded.is_set():
+                    job.modify(next_run_time=datetime.now())
     except (KeyboardInterrupt, SystemExit):
         print("shutdown scheduler")
+        if sniffer is not None:
+            sniffer.stop()
         scheduler.shutdown()
+        if spool is not None:
+            spool.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,60 @@
+import random
+
+from constants import GONE_AFTER, MAX_BACKOFF_CYCLES
+
+
+class HostHistory:
+
+    def __init__(self):
+        self.was_alive = False
+        self.misses = 0
+        self.next_cycle = 0
+
+
+# Keeps per-address liveness history and decides which addresses are probed
+# in the current cycle. Live hosts and hosts that have just gone missing are
+# probed every cycle with a single echo, addresses that never answered or are
+# gone for good are probed with exponential backoff (with jitter, so they are
+# not probed all in the same cycle).
+class ProbePlanner:
+
+    def __init__(self, gone_after=GONE_AFTER, max_backoff=MAX_BACKOFF_CYCLES):
+        self.gone_after = gone_after
+        self.max_backoff = max_backoff
+        self._history = {}
+        self._cycle = 0
+
+    def plan(self, targets):
+        self._cycle += 1
+        frequent, backoff = [], []
+
+        for ip in targets:
+            history: HostHistory = self._history.get(ip)
+            if history is None:
+                backoff.append(ip)
+            elif history.was_alive and history.misses <= self.gone_after:
+                frequent.append(ip)
+            elif history.next_cycle <= self._cycle:
+                backoff.append(ip)
+
+        skipped = len(targets) - len(frequent) - len(backoff)
+        print(f"probe planner cycle {self._cycle}: {len(frequent)} frequent, "
+              f"{len(backoff)} backoff, {skipped} skipped addresses")
+        return frequent, backoff
+
+    def record(self, probed_ips, live_ips):
+        live_ips = set(live_ips)
+
+        for ip in probed_ips:
+            history: HostHistory = self._history.setdefault(ip, HostHistory())
+            if ip in live_ips:
+                history.was_alive = True
+                history.misses = 0
+                history.next_cycle = self._cycle + 1
+                continue
+
+            history.misses += 1
+            backoff = min(2 ** history.misses, self.max_backoff)
+            history.next_cycle = self._cycle + backoff + random.randint(0, backoff // 2)
+            if history.misses > self.gone_after:
+                history.was_alive = False
@@ -1,11 +1,19 @@
+import time
+from threading import Lock
+
 import requests
 
+# seconds to wait for the collector (or listener) to answer
+REQUEST_TIMEOUT = 10
 
 collector_ip_address = "127.0.0.1"
 collector_port = "8000"
 collector_http_socket = f"http://{collector_ip_address}:{collector_port}"
 collector_api_prefix = "collector/api/v1"
 
+PINGER_ID_HEADER = "X-Pinger-Id"
+PINGER_SEQUENCE_HEADER = "X-Pinger-Seq"
+
 
 def get_url(endpoint):
     endpoint = f"{collector_api_prefix}/{endpoint}/"
@@ -13,9 +21,41 @@ def get_url(endpoint):
     return url
 
 
-def send_data(url, data, headers=None, http_method="post"):
+def send_data(url, data, headers=None, http_method="post", timeout=REQUEST_TIMEOUT):
     request_methods = {"post": requests.post, "get": requests.get}
     request_method = request_methods.get(http_method)
     print(f"method: {request_method}, data: {data}, headers: {headers}")
-    res = request_method(url=url, json=data, headers=headers)
+    res = request_method(url=url, json=data, headers=headers, timeout=timeout)
     return res
+
+
+# Every batch carries the pinger id and a sequence number which only grows,
+# so the collector skips a batch it already processed when a retry repeats it.
+# Numbers follow the wall clock to keep growing across pinger restarts, a
+# clock stepped back is caught up by `advance` to the collector high-water mark.
+class BatchSequence:
+
+    def __init__(self, pinger_id):
+        self.pinger_id = pinger_id
+        self._last = 0
+        self._lock = Lock()
+
+    def next_headers(self) -> dict:
+        with self._lock:
+            self._last = max(time.time_ns(), self._last + 1)
+            return {PINGER_ID_HEADER: self.pinger_id, PINGER_SEQUENCE_HEADER: str(self._last)}
+
+    def advance(self, sequence):
+        with self._lock:
+            self._last = max(self._last, sequence)
+
+
+def get_sequence_ahead(res_data, headers):
+    # a duplicate answer carries the collector high-water mark, a mark above
+    # the sent sequence means the batch was skipped without being applied
+    if not isinstance(res_data, dict) or not res_data.get("duplicate") or not headers:
+        return None
+    sequence = res_data.get("sequence")
+    if sequence is None or sequence <= int(headers[PINGER_SEQUENCE_HEADER]):
+        return None
+    return sequence
@@ -0,0 +1,112 @@
+import time
+from threading import Lock, Event
+
+from scapy.layers.dhcp import BOOTP, DHCP
+from scapy.layers.inet import IP, UDP
+from scapy.layers.l2 import ARP, Ether
+from scapy.sendrecv import AsyncSniffer
+from scapy.utils import str2mac
+
+# ARP, DHCP client/server and mDNS traffic
+PRESENCE_FILTER = "arp or (udp and (port 67 or port 68 or port 5353))"
+MDNS_PORT = 5353
+DHCP_REQUEST = 3
+DHCP_ACK = 5
+EMPTY_IP_ADDR = "0.0.0.0"
+
+
+class PresenceTable:
+
+    def __init__(self, ignored_ips=()):
+        self.ignored_ips = {str(ip) for ip in ignored_ips}
+        self._hosts = {}
+        self._lock = Lock()
+
+    def update(self, ip, mac_addr, seen_at=None) -> bool:
+        if not ip or ip == EMPTY_IP_ADDR or ip in self.ignored_ips:
+            return False
+
+        seen_at = seen_at or time.monotonic()
+        with self._lock:
+            is_new = ip not in self._hosts or self._hosts[ip][0] != mac_addr
+            self._hosts[ip] = (mac_addr, seen_at)
+        return is_new
+
+    def quiet_hosts(self, quiet_after) -> list:
+        border = time.monotonic() - quiet_after
+        with self._lock:
+            return [ip for ip, (_, seen_at) in self._hosts.items() if seen_at < border]
+
+    def live_hosts(self, quiet_after) -> dict:
+        border = time.monotonic() - quiet_after
+        with self._lock:
+            return {
+                ip: mac_addr
+                for ip, (mac_addr, seen_at) in self._hosts.items()
+                if seen_at >= border
+            }
+
+    def forget_hosts(self, forget_after):
+        border = time.monotonic() - forget_after
+        with self._lock:
+            stale_ips = [ip for ip, (_, seen_at) in self._hosts.items() if seen_at < border]
+            for ip in stale_ips:
+                del self._hosts[ip]
+        if stale_ips:
+            print(f"presence table forgot hosts: {stale_ips}")
+
+
+class PresenceSniffer:
+
+    def __init__(self, nic, table: PresenceTable):
+        self.table = table
+        # set whenever a host shows up which was not in the table before
+        self.arrived = Event()
+        self._sniffer = AsyncSniffer(
+            iface=nic,
+            filter=PRESENCE_FILTER,
+            prn=self.handle_packet,
+            store=False,
+        )
+
+    def start(self):
+        print(f"presence sniffer started with filter: {PRESENCE_FILTER}")
+        self._sniffer.start()
+
+    def stop(self):
+        self._sniffer.stop()
+
+    def handle_packet(self, packet):
+        if ARP in packet:
+            arp: ARP = packet[ARP]
+            host = arp.psrc, arp.hwsrc
+        elif DHCP in packet:
+            host = self.parse_dhcp(packet)
+        elif UDP in packet and packet[UDP].sport == MDNS_PORT and IP in packet:
+            host = packet[IP].src, packet[Ether].src
+        else:
+            host = None
+
+        if host is None:
+            return
+        ip, mac_addr = host
+        if self.table.update(ip, mac_addr):
+            print(f"presence sniffer found host: {ip} {mac_addr}")
+            self.arrived.set()
+
+    @staticmethod
+    def parse_dhcp(packet):
+        bootp: BOOTP = packet[BOOTP]
+        options = {
+            option[0]: option[1]
+            for option in packet[DHCP].options
+            if isinstance(option, tuple) and len(option) > 1
+        }
+        message_type = options.get("message-type")
+        mac_addr = str2mac(bootp.chaddr[:6])
+
+        if message_type == DHCP_REQUEST:
+            return options.get("requested_addr") or bootp.ciaddr, mac_addr
+        if message_type == DHCP_ACK:
+            return bootp.yiaddr, mac_addr
+        return None
@@ -0,0 +1,246 @@
+import json
+import os
+import time
+from collections import deque
+from threading import Thread, Lock, Event
+
+from requests.exceptions import RequestException
+
+from constants import (
+    SPOOL_SEGMENT_RECORDS,
+    SPOOL_MAX_ATTEMPTS,
+    SPOOL_MAX_RETRIES,
+    SPOOL_MAX_BACKOFF,
+)
+from sender import send_data, get_sequence_ahead
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+CURSOR_FILE = "cursor.json"
+DEAD_LETTER_FILE = "dead-letter.log"
+
+
+# Append-only on-disk queue of collector submissions.
+# Records are JSON lines in numbered segment files, every record is fsynced
+# before `append` returns, a cursor file remembers the first undelivered
+# record. A drainer thread delivers records in order: a full snapshot
+# supersedes every older record of the same network, connection errors and
+# 5xx answers are retried with capped exponential backoff up to `max_retries`
+# times, a record rejected `max_attempts` times or out of retries is moved
+# to the dead letter file.
+class Spool:
+
+    def __init__(self, directory, on_failure=None, segment_records=SPOOL_SEGMENT_RECORDS,
+                 max_attempts=SPOOL_MAX_ATTEMPTS, max_retries=SPOOL_MAX_RETRIES,
+                 max_backoff=SPOOL_MAX_BACKOFF, sequence=None):
+        self.directory = directory
+        # called with the record when it is dropped, skipped as a duplicate of
+        # an unapplied batch or the collector asks for resync
+        self.on_failure = on_failure
+        self.sequence = sequence
+        self.segment_records = segment_records
+        self.max_attempts = max_attempts
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+
+        self._pending = deque()
+        self._lock = Lock()
+        self._appended = Event()
+        self._stopped = Event()
+        self._segment_file = None
+        self._segment_number = 0
+        self._segment_size = 0
+        self._unsynced = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        self._drainer = Thread(target=self._drain, name="spool-drainer", daemon=True)
+
+    def start(self):
+        print(f"spool drainer started with {len(self._pending)} pending records")
+        self._drainer.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._appended.set()
+        with self._lock:
+            self._sync()
+            if self._segment_file is not None:
+                self._segment_file.close()
+
+    def append(self, url, payload, ssid, headers=None):
+        # headers are stored with the record, so a retry repeats its sequence number
+        record = {
+            "url": url,
+            "payload": payload,
+            "ssid": ssid,
+            "headers": headers,
+            "is_snapshot": isinstance(payload, list),
+            "created": time.time(),
+        }
+        with self._lock:
+            if self._segment_file is None or self._segment_size >= self.segment_records:
+                self._open_segment(self._segment_number + 1)
+            self._segment_file.write(json.dumps(record) + "\n")
+            self._segment_file.flush()
+            self._pending.append((self._segment_number, self._segment_size, record))
+            self._segment_size += 1
+            self._unsynced += 1
+            self._sync()
+        self._appended.set()
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:08d}{SEGMENT_SUFFIX}")
+
+    def _open_segment(self, number):
+        self._sync()
+        if self._segment_file is not None:
+            self._segment_file.close()
+        self._segment_number = number
+        self._segment_size = 0
+        self._segment_file = open(self._segment_path(number), "a")
+
+    def _sync(self):
+        if self._segment_file is not None and self._unsynced:
+            os.fsync(self._segment_file.fileno())
+            self._unsynced = 0
+
+    def _load(self):
+        cursor = self._read_cursor()
+        segment_numbers = sorted(
+            int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+        for number in segment_numbers:
+            with open(self._segment_path(number)) as segment:
+                for index, line in enumerate(segment):
+                    if (number, index) < cursor:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # a torn write at the tail of a segment after a crash
+                        print(f"spool skips broken record {index} in segment {number}")
+                        continue
+                    self._pending.append((number, index, record))
+
+        # new records always go into a fresh segment
+        self._segment_number = segment_numbers[-1] if segment_numbers else 0
+
+    def _read_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as cursor_file:
+                cursor = json.load(cursor_file)
+            return cursor["segment"], cursor["index"]
+        except (OSError, ValueError, KeyError):
+            return 0, 0
+
+    def _write_cursor(self, segment, index):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as cursor_file:
+            json.dump({"segment": segment, "index": index}, cursor_file)
+        os.replace(tmp_path, path)
+
+        # segments before the cursor are fully delivered
+        for name in os.listdir(self.directory):
+            if not (name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)):
+                continue
+            number = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            if number < segment and number != self._segment_number:
+                os.remove(os.path.join(self.directory, name))
+
+    def _next_record(self):
+        with self._lock:
+            if not self._pending:
+                return None
+            # latest full snapshot for every network supersedes older records
+            latest_snapshots = {}
+            for position, (_, _, record) in enumerate(self._pending):
+                if record["is_snapshot"]:
+                    latest_snapshots[record["ssid"]] = position
+
+            while self._pending:
+                number, index, record = self._pending[0]
+                if latest_snapshots.get(record["ssid"], 0) > 0:
+                    print(f"spool coalesced stale record for `{record['ssid']}`")
+                    self._pending.popleft()
+                    for ssid in latest_snapshots:
+                        latest_snapshots[ssid] -= 1
+                    self._write_cursor(number, index + 1)
+                    continue
+                return number, index, record
+            return None
+
+    def _ack(self, number, index):
+        with self._lock:
+            if self._pending and self._pending[0][:2] == (number, index):
+                self._pending.popleft()
+            self._write_cursor(number, index + 1)
+
+    def _drain(self):
+        backoff = 1
+        attempts = 0
+        retries = 0
+
+        while not self._stopped.is_set():
+            next_record = self._next_record()
+            if next_record is None:
+                self._appended.wait(timeout=1)
+                self._appended.clear()
+                continue
+
+            number, index, record = next_record
+            try:
+                res = send_data(record["url"], record["payload"], headers=record.get("headers"))
+                error = f"{res.status_code} {res.text}" if res.status_code >= 500 else None
+            except RequestException as e:
+                res, error = None, str(e)
+
+            if error is not None:
+                retries += 1
+                if retries < self.max_retries:
+                    print(f"spool delivery failed: {error} - retry in {backoff} sec")
+                    self._stopped.wait(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+                self._dead_letter(record, f"failed {retries} times: {error}")
+            elif not res.ok:
+                attempts += 1
+                print(f"collector rejected spooled record: {res.status_code} {res.text}")
+                if attempts < self.max_attempts:
+                    self._stopped.wait(1)
+                    continue
+                self._dead_letter(record, f"rejected {attempts} times: {res.status_code} {res.text}")
+            else:
+                try:
+                    res_data = res.json()
+                except ValueError:
+                    # the collector accepted the record, the answer just says nothing more
+                    res_data = None
+                print(f"spool delivered record: {res_data}")
+                sequence_ahead = get_sequence_ahead(res_data, record.get("headers"))
+                if sequence_ahead is not None:
+                    print(f"spooled record for `{record['ssid']}` was skipped by the collector, "
+                          f"its sequence is behind {sequence_ahead}")
+                    if self.sequence is not None:
+                        self.sequence.advance(sequence_ahead)
+                    self._notify_failure(record)
+                elif isinstance(res_data, dict) and res_data.get("resync"):
+                    self._notify_failure(record)
+
+            backoff = 1
+            attempts = 0
+            retries = 0
+            self._ack(number, index)
+
+    def _dead_letter(self, record, reason):
+        print(f"spooled record for `{record['ssid']}` moved to dead letters, {reason}")
+        with open(os.path.join(self.directory, DEAD_LETTER_FILE), "a") as dead_letter_file:
+            dead_letter_file.write(json.dumps({**record, "reason": reason}) + "\n")
+        self._notify_failure(record)
+
+    def _notify_failure(self, record):
+        if self.on_failure is not None:
+            self.on_failure(record)
@@ -0,0 +1,266 @@
+import argparse
+import os
+import socket
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from ipaddress import IPv4Address, IPv4Network
+
+import tzlocal
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from arp import sweep_mac_addresses
+from constants import SCAN_INTERVAL, SCAN_RESERVE, DEFAULT_PPS
+from cycle import ScanCycle
+from delta import DeltaReporter
+from pacing import TokenBucket
+from pinger import (
+    SCAN_ENGINES,
+    get_nic_ip_address,
+    get_nic_prefix,
+    get_network,
+    prepare_data_to_send,
+    report_devices,
+)
+from sender import BatchSequence
+from spool import Spool
+
+
+def parse_target(value):
+    nic, _, ssid = value.partition(":")
+    if not nic or not ssid:
+        raise argparse.ArgumentTypeError(f"target `{value}` is not in `nic:ssid` form")
+    return nic, ssid
+
+
+def get_shards(net: IPv4Network, shard_prefix):
+    if shard_prefix is None or shard_prefix <= net.prefixlen:
+        return [net]
+    return list(net.subnets(new_prefix=shard_prefix))
+
+
+def scan_shard(nic, ssid, shard, excluded_ips, count, timeout, interval, threads, engine,
+               mac_resolver, pps, deadline):
+    # runs in a pool process, `deadline` is the wall clock end of the whole cycle,
+    # so a shard which waited in the pool queue only gets what is left of it
+    deadline = time.perf_counter() + (deadline - time.time())
+    targets = [str(ip) for ip in IPv4Network(shard) if str(ip) not in excluded_ips]
+    print(f"scanning shard {shard} of `{ssid}` on {nic} in process {os.getpid()}")
+
+    pacer = TokenBucket(rate=pps)
+    scan = SCAN_ENGINES[engine]
+    live_ips, scanned_ips = scan(targets, count, timeout, interval, threads, pacer, deadline)
+
+    mac_map = None
+    if mac_resolver == "sweep":
+        mac_map = sweep_mac_addresses(live_ips, nic=nic, pps=pps)
+    data = prepare_data_to_send(live_ips=live_ips, ssid=ssid, mac_map=mac_map)
+    return data, scanned_ips
+
+
+def count_targets(shard, excluded_ips):
+    shard = IPv4Network(shard)
+    return shard.num_addresses - sum(IPv4Address(ip) in shard for ip in excluded_ips)
+
+
+def run_supervisor(targets, shard_prefix, executor: ProcessPoolExecutor, engine, mac_resolver,
+                   pps, reporters, spool=None, cycle=None, sequence=None):
+    print(f"supervisor started for targets: {targets}")
+    start_time = time.perf_counter()
+    budget = cycle.budget if cycle is not None else SCAN_INTERVAL - SCAN_RESERVE
+    deadline = time.time() + budget
+
+    shards = []
+    for nic, ssid in targets:
+        ip_addr = get_nic_ip_address(nic)
+        net: IPv4Network = get_network(ip_addr, prefix=get_nic_prefix(nic))
+        management_ips = (IPv4Address(ip_addr), net.broadcast_address, net.network_address)
+        excluded_ips = {str(ip) for ip in management_ips}
+        nic_shards = get_shards(net, shard_prefix)
+        # shards of one NIC share its packets-per-second budget
+        for shard in nic_shards:
+            shards.append((nic, ssid, str(shard), excluded_ips, pps / len(nic_shards)))
+
+    futures = {}
+    shards_left = defaultdict(int)
+    for nic, ssid, shard, excluded_ips, shard_pps in shards:
+        shard_kwargs = {
+            "nic": nic,
+            "ssid": ssid,
+            "shard": shard,
+            "excluded_ips": excluded_ips,
+            "count": 3,
+            "timeout": 2,
+            "interval": 1,
+            "threads": 100,
+            "engine": engine,
+            "mac_resolver": mac_resolver,
+            "pps": shard_pps,
+            "deadline": deadline,
+        }
+        future = executor.submit(scan_shard, **shard_kwargs)
+        futures[future] = (ssid, shard, count_targets(shard, excluded_ips))
+        shards_left[ssid] += 1
+
+    # every network is reported as soon as all of its shards are done,
+    # so a slow network does not hold up the others
+    merged = defaultdict(dict)
+    scanned = defaultdict(list)
+    totals = defaultdict(int)
+    for future in as_completed(futures):
+        ssid, shard, total = futures[future]
+        totals[ssid] += total
+        shards_left[ssid] -= 1
+        try:
+            data, scanned_ips = future.result()
+        except Exception as e:
+            # addresses of a failed shard are not scanned, the network is
+            # still reported as partial with what the other shards found
+            print(f"error: {e} while scanning shard {shard} of `{ssid}`")
+        else:
+            for device in data:
+                merged[ssid][device["device_mac_addr"]] = device
+            scanned[ssid] += scanned_ips
+
+        if shards_left[ssid]:
+            continue
+
+        is_partial = len(scanned[ssid]) < totals[ssid]
+        print(f"`{ssid}` scanned {len(scanned[ssid])} of {totals[ssid]} addresses, "
+              f"devices found: {len(merged[ssid])}")
+        report_devices(
+            data=list(merged[ssid].values()),
+            ssid=ssid,
+            reporter=reporters.get(ssid),
+            scanned_ips=scanned[ssid] if is_partial else None,
+            spool=spool,
+            sequence=sequence,
+        )
+
+    print(f"supervisor cycle takes {time.perf_counter() - start_time} sec")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Pinger supervisor for several NICs/networks")
+    parser.add_argument(
+        "--target",
+        type=parse_target,
+        dest="targets",
+        help="NIC and network SSID pair in `nic:ssid` form, may be repeated",
+        action="append",
+        required=True,
+    )
+    parser.add_argument(
+        "--shard-prefix",
+        type=int,
+        dest="shard_prefix",
+        help="Split networks larger than this prefix into shards of this size",
+        default=None,
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        dest="processes",
+        help="Scanning processes, CPU count by default",
+        default=None,
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        dest="engine",
+        choices=list(SCAN_ENGINES),
+        default="async",
+    )
+    parser.add_argument(
+        "--mac-resolver",
+        type=str,
+        dest="mac_resolver",
+        choices=["sweep", "host"],
+        default="sweep",
+    )
+    parser.add_argument(
+        "--pps",
+        type=int,
+        dest="pps",
+        help="Probe budget in packets per second for every NIC",
+        default=DEFAULT_PPS,
+    )
+    parser.add_argument(
+        "--budget",
+        type=int,
+        dest="budget",
+        default=SCAN_INTERVAL - SCAN_RESERVE,
+    )
+    parser.add_argument("--full-snapshots", dest="full_snapshots", action="store_true")
+    parser.add_argument("--spool-dir", type=str, dest="spool_dir", default=None)
+    parser.add_argument(
+        "--pinger-id",
+        type=str,
+        dest="pinger_id",
+        help="Pinger id sent with every batch, `<hostname>-supervisor` by default",
+        default=None,
+    )
+    return parser.parse_args()
+
+
+def main():
+    parser_args = parse_arguments()
+    ssids = {ssid for _, ssid in parser_args.targets}
+    reporters = {} if parser_args.full_snapshots else {ssid: DeltaReporter(ssid) for ssid in ssids}
+    spool = None
+
+    if parser_args.spool_dir is not None:
+
+        def reset_reporter(record):
+            reporter = reporters.get(record["ssid"])
+            if reporter is not None:
+                reporter.reset()
+
+        spool = Spool(directory=parser_args.spool_dir, on_failure=reset_reporter)
+
+    executor = ProcessPoolExecutor(max_workers=parser_args.processes)
+    supervisor_kwargs = {
+        "targets": parser_args.targets,
+        "shard_prefix": parser_args.shard_prefix,
+        "executor": executor,
+        "engine": parser_args.engine,
+        "mac_resolver": parser_args.mac_resolver,
+        "pps": parser_args.pps,
+        "reporters": reporters,
+        "spool": spool,
+        "sequence": BatchSequence(parser_args.pinger_id or f"{socket.gethostname()}-supervisor"),
+    }
+    cycle = ScanCycle(budget=parser_args.budget)
+    scheduler_kwargs = {
+        "func": cycle.run,
+        "kwargs": {"func": run_supervisor, **supervisor_kwargs},
+        "trigger": "interval",
+        "seconds": SCAN_INTERVAL,
+        "next_run_time": datetime.now(),
+        "max_instances": 1,
+        "coalesce": True,
+    }
+
+    print("create scheduler")
+    scheduler = BackgroundScheduler(timezone=str(tzlocal.get_localzone()))
+    scheduler.add_job(**scheduler_kwargs)
+
+    print("start scheduler")
+    scheduler.start()
+    if spool is not None:
+        spool.start()
+
+    try:
+        while True:
+            time.sleep(3)
+    except (KeyboardInterrupt, SystemExit):
+        print("shutdown scheduler")
+        scheduler.shutdown()
+        executor.shutdown()
+        if spool is not None:
+            spool.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import asyncio
+
+from constants import TCP_CONNECT_TIMEOUT, TCP_CONCURRENCY
+
+
+async def probe_port(ip, port, timeout) -> bool:
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except ConnectionRefusedError:
+        # RST from a closed port still proves the host is up
+        return True
+    except (asyncio.TimeoutError, OSError):
+        return False
+    writer.close()
+    return True
+
+
+async def probe_host(ip, ports, timeout, semaphore, pacer=None) -> bool:
+    async with semaphore:
+        if pacer is not None:
+            await pacer.async_wait(len(ports))
+        probes = [asyncio.ensure_future(probe_port(ip, port, timeout)) for port in ports]
+        try:
+            for probe in asyncio.as_completed(probes):
+                if await probe:
+                    return True
+        finally:
+            for probe in probes:
+                probe.cancel()
+    return False
+
+
+async def probe_hosts(ips, ports, timeout, pacer=None, concurrency=TCP_CONCURRENCY) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(
+        *(probe_host(ip, ports, timeout, semaphore, pacer) for ip in ips)
+    )
+    return [ip for ip, is_alive in zip(ips, results) if is_alive]
+
+
+def scan_tcp(ips, ports, timeout=TCP_CONNECT_TIMEOUT, pacer=None) -> list:
+    if not ips:
+        return []
+    live_ips = asyncio.run(probe_hosts(ips, ports, timeout, pacer=pacer))
+    print(f"tcp probe of {len(ips)} hosts on ports {ports}: {len(live_ips)} hosts answered")
+    return live_ips
@@ -0,0 +1,450 @@
+import json
+import struct
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from ipaddress import IPv4Network
+from threading import Event
+from unittest import mock
+
+from requests.exceptions import RequestException
+
+from cycle import ScanCycle
+from delta import DeltaReporter
+from icmp_engine import ICMP_ECHO_REPLY, build_echo_request, get_checksum, parse_echo_reply
+from mac_resolver import MacResolver
+from pacing import TokenBucket
+from probe_planner import ProbePlanner
+from sender import BatchSequence, PINGER_SEQUENCE_HEADER
+from metrics import MAC_LOOKUPS, MAC_CACHE_ENTRIES
+from pinger import report_devices, seed_presence_table, schedule_after_seed
+from sniffer import PresenceTable
+from spool import Spool, DEAD_LETTER_FILE
+from supervisor import run_supervisor
+
+NIC_IP = "10.0.0.1"
+
+
+def device(mac_addr, ipv4, ssid="home"):
+    return {"network_ssid": ssid, "device_mac_addr": mac_addr, "device_ipv4_addr": ipv4}
+
+
+def shard_targets(shard, excluded_ips):
+    return [str(ip) for ip in IPv4Network(shard) if str(ip) not in excluded_ips]
+
+
+class SupervisorShardTest(unittest.TestCase):
+
+    def run_supervisor(self, scan_shard, shard_prefix=25, cycle=None):
+        with mock.patch("supervisor.get_nic_ip_address", return_value=NIC_IP), \
+                mock.patch("supervisor.get_nic_prefix", return_value=24), \
+                mock.patch("supervisor.scan_shard", side_effect=scan_shard), \
+                mock.patch("supervisor.report_devices") as report_devices, \
+                ThreadPoolExecutor(max_workers=1) as executor:
+            run_supervisor(
+                targets=[("eth0", "home")],
+                shard_prefix=shard_prefix,
+                executor=executor,
+                engine="async",
+                mac_resolver="sweep",
+                pps=100,
+                reporters={},
+                cycle=cycle,
+            )
+        return report_devices
+
+    def test_network_is_reported_once_all_shards_are_done(self):
+
+        def scan_shard(shard, excluded_ips, **kwargs):
+            targets = shard_targets(shard, excluded_ips)
+            return [device(f"02:00:00:00:00:{targets[-1][-3:]}", targets[-1])], targets
+
+        report_devices = self.run_supervisor(scan_shard)
+        report_devices.assert_called_once()
+        kwargs = report_devices.call_args.kwargs
+        self.assertEqual(kwargs["ssid"], "home")
+        self.assertEqual(len(kwargs["data"]), 2)
+        self.assertIsNone(kwargs["scanned_ips"])
+
+    def test_failed_shard_is_reported_as_partial(self):
+
+        def scan_shard(shard, excluded_ips, **kwargs):
+            if shard == "10.0.0.128/25":
+                raise OSError("shard process died")
+            return [device("02:00:00:00:00:02", "10.0.0.2")], shard_targets(shard, excluded_ips)
+
+        report_devices = self.run_supervisor(scan_shard)
+        report_devices.assert_called_once()
+        kwargs = report_devices.call_args.kwargs
+        self.assertEqual(kwargs["data"], [device("02:00:00:00:00:02", "10.0.0.2")])
+        # the network address and the NIC address are not scanned
+        self.assertEqual(len(kwargs["scanned_ips"]), 126)
+        self.assertNotIn("10.0.0.130", kwargs["scanned_ips"])
+
+    def test_shards_share_the_cycle_deadline(self):
+        deadlines = []
+
+        def scan_shard(shard, excluded_ips, deadline, **kwargs):
+            # shards wait for the single pool process one after another
+            time.sleep(0.05)
+            deadlines.append(deadline)
+            return [], shard_targets(shard, excluded_ips)
+
+        start_time = time.time()
+        self.run_supervisor(scan_shard, shard_prefix=26, cycle=mock.Mock(budget=10))
+        self.assertEqual(len(deadlines), 4)
+        self.assertEqual(len(set(deadlines)), 1)
+        self.assertLessEqual(deadlines[0], time.time() + 10)
+        self.assertGreaterEqual(deadlines[0], start_time + 10)
+
+
+class SpoolTest(unittest.TestCase):
+    url = "http://collector/collector/api/v1/device-sessions/"
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        patcher = mock.patch("spool.send_data")
+        self.send_data = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.send_data.return_value = mock.Mock(ok=True, status_code=200, json=lambda: [])
+
+    def create_spool(self, **kwargs):
+        return Spool(directory=self.directory, **kwargs)
+
+    def delta(self, ssid="home"):
+        return {"mode": "delta", "network_ssid": ssid, "appeared": [], "changed": [], "disappeared": []}
+
+    def drain(self, spool):
+        spool.start()
+        deadline = time.monotonic() + 5
+        while spool._pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+        spool.stop()
+        spool._drainer.join()
+
+    def test_records_survive_restart(self):
+        spool = self.create_spool(segment_records=2)
+        for sequence in range(3):
+            spool.append(url=self.url, payload=self.delta(), ssid="home", headers={"seq": sequence})
+        spool._segment_file.write('{"url": "torn')
+        spool._segment_file.flush()
+
+        records = [record for _, _, record in self.create_spool()._pending]
+        self.assertEqual([record["headers"] for record in records], [{"seq": 0}, {"seq": 1}, {"seq": 2}])
+
+    def test_delivered_records_are_not_loaded_again(self):
+        spool = self.create_spool(segment_records=2)
+        for _ in range(3):
+            spool.append(url=self.url, payload=self.delta(), ssid="home")
+        self.drain(spool)
+        self.assertEqual(self.send_data.call_count, 3)
+
+        spool = self.create_spool()
+        self.assertEqual(len(spool._pending), 0)
+        spool.append(url=self.url, payload=self.delta(), ssid="home")
+        self.assertEqual(len(self.create_spool()._pending), 1)
+
+    def test_full_snapshot_supersedes_older_records(self):
+        spool = self.create_spool()
+        spool.append(url=self.url, payload=self.delta(), ssid="home")
+        spool.append(url=self.url, payload=self.delta("office"), ssid="office")
+        spool.append(url=self.url, payload=[], ssid="home")
+        spool.append(url=self.url, payload=self.delta(), ssid="home")
+        self.drain(spool)
+
+        payloads = [call.args[1] for call in self.send_data.call_args_list]
+        self.assertEqual(payloads, [self.delta("office"), [], self.delta()])
+
+    def test_failing_record_is_dead_lettered(self):
+        failures = []
+        spool = self.create_spool(on_failure=failures.append, max_retries=1, max_attempts=1)
+        self.send_data.side_effect = [
+            mock.Mock(ok=False, status_code=500, text="error"),
+            RequestException("refused"),
+            mock.Mock(ok=False, status_code=400, text="bad request"),
+            self.send_data.return_value,
+        ]
+        for _ in range(4):
+            spool.append(url=self.url, payload=self.delta(), ssid="home")
+        self.drain(spool)
+
+        self.assertEqual(len(failures), 3)
+        with open(os.path.join(self.directory, DEAD_LETTER_FILE)) as dead_letter_file:
+            reasons = [json.loads(line)["reason"] for line in dead_letter_file]
+        self.assertEqual(len(reasons), 3)
+        self.assertIn("500", reasons[0])
+        self.assertIn("refused", reasons[1])
+        self.assertIn("400", reasons[2])
+
+    def test_accepted_record_without_json_answer(self):
+        spool = self.create_spool()
+        self.send_data.return_value = mock.Mock(
+            ok=True, status_code=200, json=mock.Mock(side_effect=ValueError("no json")),
+        )
+        spool.append(url=self.url, payload=self.delta(), ssid="home")
+        spool.append(url=self.url, payload=self.delta(), ssid="home")
+        self.drain(spool)
+        self.assertEqual(self.send_data.call_count, 2)
+        self.assertEqual(len(spool._pending), 0)
+
+    def test_record_skipped_as_duplicate_advances_sequence(self):
+        failures = []
+        sequence = BatchSequence("pinger")
+        spool = self.create_spool(on_failure=failures.append, sequence=sequence)
+        headers = sequence.next_headers()
+        high_water_mark = int(headers[PINGER_SEQUENCE_HEADER]) + 10 ** 12
+        self.send_data.return_value = mock.Mock(
+            ok=True, status_code=200, json=lambda: {"duplicate": True, "sequence": high_water_mark},
+        )
+        spool.append(url=self.url, payload=self.delta(), ssid="home", headers=headers)
+        self.drain(spool)
+
+        self.assertEqual(len(failures), 1)
+        self.assertGreater(int(sequence.next_headers()[PINGER_SEQUENCE_HEADER]), high_water_mark)
+
+
+class ReportDevicesTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch("pinger.send_data", side_effect=RequestException("timed out"))
+        self.send_data = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_collector_error_does_not_fail_the_cycle(self):
+        report_devices(data=[device("02:00:00:00:00:02", "10.0.0.2")], ssid="home")
+        self.send_data.assert_called_once()
+
+    def test_collector_error_resets_reporter(self):
+        reporter = DeltaReporter("home")
+        reporter.commit({"02:00:00:00:00:02": "10.0.0.2"})
+        report_devices(data=[device("02:00:00:00:00:02", "10.0.0.2")], ssid="home", reporter=reporter)
+
+        payload, _ = reporter.prepare([device("02:00:00:00:00:02", "10.0.0.2")])
+        self.assertIsInstance(payload, list)
+
+    def test_report_skipped_as_duplicate_advances_sequence(self):
+        sequence = BatchSequence("pinger")
+        high_water_mark = time.time_ns() + 10 ** 12
+        self.send_data.side_effect = None
+        self.send_data.return_value = mock.Mock(
+            ok=True, status_code=200, json=lambda: {"duplicate": True, "sequence": high_water_mark},
+        )
+        reporter = DeltaReporter("home")
+        reporter.commit({"02:00:00:00:00:02": "10.0.0.2"})
+        report_devices(
+            data=[device("02:00:00:00:00:03", "10.0.0.3")], ssid="home", reporter=reporter, sequence=sequence,
+        )
+
+        payload, _ = reporter.prepare([device("02:00:00:00:00:03", "10.0.0.3")])
+        self.assertIsInstance(payload, list)
+        self.assertGreater(int(sequence.next_headers()[PINGER_SEQUENCE_HEADER]), high_water_mark)
+
+    def test_retried_duplicate_keeps_reporter_state(self):
+        sequence = BatchSequence("pinger")
+        self.send_data.side_effect = lambda url, payload, headers: mock.Mock(
+            ok=True, status_code=200,
+            json=lambda: {"duplicate": True, "sequence": int(headers[PINGER_SEQUENCE_HEADER])},
+        )
+        reporter = DeltaReporter("home")
+        reporter.commit({"02:00:00:00:00:02": "10.0.0.2"})
+        report_devices(
+            data=[device("02:00:00:00:00:02", "10.0.0.2")], ssid="home", reporter=reporter, sequence=sequence,
+        )
+
+        payload, _ = reporter.prepare([device("02:00:00:00:00:02", "10.0.0.2")])
+        self.assertIsInstance(payload, dict)
+
+
+class PresenceSeedTest(unittest.TestCase):
+
+    def test_seed_sweeps_in_chunks_until_budget_is_spent(self):
+        swept = []
+
+        def sweep_mac_addresses(targets, nic, pps):
+            time.sleep(0.1)
+            swept.append(targets)
+            return {ip: f"02:00:00:00:00:{ip[-2:]}" for ip in targets}
+
+        table = PresenceTable()
+        targets = [f"10.0.0.{i}" for i in range(10, 35)]
+        with mock.patch("pinger.sweep_mac_addresses", side_effect=sweep_mac_addresses):
+            seed_presence_table(table, targets, nic="eth0", pps=1, budget=0.15)
+
+        self.assertEqual(swept, [targets[:10], targets[10:20]])
+        self.assertEqual(sorted(table.live_hosts(quiet_after=60)), targets[:20])
+
+    def test_job_is_scheduled_once_seed_finishes(self):
+        job, seeded = mock.Mock(), Event()
+
+        def seed_presence_table(**kwargs):
+            self.assertFalse(seeded.is_set())
+            job.modify.assert_not_called()
+            raise OSError("no such device")
+
+        with mock.patch("pinger.seed_presence_table", side_effect=seed_presence_table), \
+                self.assertRaises(OSError):
+            schedule_after_seed(job, seeded, table=PresenceTable(), targets=[], nic="eth0", pps=1, budget=1)
+
+        self.assertTrue(seeded.is_set())
+        job.modify.assert_called_once()
+
+
+class MacResolverTest(unittest.TestCase):
+
+    def lookups(self):
+        return {result: MAC_LOOKUPS._values.get((("result", result),), 0) for result in ("cache", "neighbor", "arp")}
+
+    def test_lookups_are_counted_by_source(self):
+        resolver = MacResolver(nic="eth0")
+        before = self.lookups()
+        with mock.patch("mac_resolver.read_neighbor_table", return_value={"10.0.0.2": "02:00:00:00:00:02"}), \
+                mock.patch("mac_resolver.get_mac", return_value=None) as get_mac:
+            self.assertEqual(resolver.resolve_many(["10.0.0.2", "10.0.0.3"]), {"10.0.0.2": "02:00:00:00:00:02"})
+            self.assertEqual(resolver.resolve_many(["10.0.0.2"]), {"10.0.0.2": "02:00:00:00:00:02"})
+        get_mac.assert_called_once_with("10.0.0.3")
+
+        after = self.lookups()
+        self.assertEqual({result: after[result] - before[result] for result in after},
+                         {"cache": 1, "neighbor": 1, "arp": 1})
+        self.assertEqual(MAC_CACHE_ENTRIES._values[()], 1)
+
+
+class DeltaReporterTest(unittest.TestCase):
+
+    def test_first_cycle_sends_full_snapshot(self):
+        data = [device("02:00:00:00:00:02", "10.0.0.2")]
+        payload, state = DeltaReporter("home").prepare(data)
+        self.assertEqual(payload, data)
+        self.assertEqual(state, {"02:00:00:00:00:02": "10.0.0.2"})
+
+    def test_delta_of_changed_devices(self):
+        reporter = DeltaReporter("home")
+        reporter.commit({"02:00:00:00:00:02": "10.0.0.2", "02:00:00:00:00:03": "10.0.0.3"})
+        payload, _ = reporter.prepare([
+            device("02:00:00:00:00:02", "10.0.0.12"),
+            device("02:00:00:00:00:04", "10.0.0.4"),
+        ])
+        self.assertEqual(payload["appeared"], [{"device_mac_addr": "02:00:00:00:00:04", "device_ipv4_addr": "10.0.0.4"}])
+        self.assertEqual(payload["changed"], [{"device_mac_addr": "02:00:00:00:00:02", "device_ipv4_addr": "10.0.0.12"}])
+        self.assertEqual(payload["disappeared"], ["02:00:00:00:00:03"])
+        self.assertEqual(payload["heartbeat"], {"live_devices": 2})
+        self.assertFalse(payload["partial"])
+
+    def test_partial_delta_keeps_unscanned_devices(self):
+        reporter = DeltaReporter("home")
+        reporter.commit({"02:00:00:00:00:02": "10.0.0.2", "02:00:00:00:00:03": "10.0.0.3"})
+        payload, state = reporter.prepare([], scanned_ips=["10.0.0.2"])
+        self.assertEqual(payload["disappeared"], ["02:00:00:00:00:02"])
+        self.assertEqual(payload["heartbeat"], {"live_devices": 1})
+        self.assertTrue(payload["partial"])
+        self.assertEqual(state, {"02:00:00:00:00:03": "10.0.0.3"})
+
+    def test_partial_delta_carries_scanned_ranges(self):
+        reporter = DeltaReporter("home")
+        scanned_ips = [f"10.0.0.{i}" for i in range(4, 8)] + ["10.0.0.9"]
+        payload, _ = reporter.prepare([device("02:00:00:00:00:04", "10.0.0.4")], scanned_ips=scanned_ips)
+        self.assertEqual(payload["scanned"], ["10.0.0.4/30", "10.0.0.9/32"])
+        self.assertTrue(payload["complete"])
+
+        reporter.commit({"02:00:00:00:00:04": "10.0.0.4"})
+        payload, _ = reporter.prepare([], scanned_ips=scanned_ips)
+        self.assertFalse(payload["complete"])
+
+    def test_full_snapshot_is_sent_periodically_and_after_reset(self):
+        reporter = DeltaReporter("home", full_snapshot_every=2)
+        data = [device("02:00:00:00:00:02", "10.0.0.2")]
+        kinds = []
+        for _ in range(4):
+            payload, state = reporter.prepare(data)
+            kinds.append(type(payload))
+            reporter.commit(state)
+        self.assertEqual(kinds, [list, dict, list, dict])
+
+        reporter.reset()
+        payload, _ = reporter.prepare(data)
+        self.assertIsInstance(payload, list)
+
+
+class ScanCycleTest(unittest.TestCase):
+
+    def test_unscanned_addresses_go_first_next_cycle(self):
+        cycle = ScanCycle(budget=10)
+        targets = [f"10.0.0.{i}" for i in range(2, 8)]
+        cycle.carry(targets, scanned_ips=targets[:4])
+        self.assertEqual(cycle.order(targets), targets[4:] + targets[:4])
+
+        cycle.carry(targets, scanned_ips=targets)
+        self.assertEqual(cycle.order(targets), targets)
+
+    def test_overlapping_cycle_is_skipped(self):
+        cycle = ScanCycle(budget=10)
+        runs = []
+
+        def func(cycle):
+            runs.append(cycle)
+            cycle.run(func=lambda cycle: runs.append("nested"))
+
+        cycle.run(func=func)
+        self.assertEqual(runs, [cycle])
+
+
+class IcmpPacketTest(unittest.TestCase):
+
+    def test_echo_request_checksum(self):
+        packet = build_echo_request(identifier=0x1234, sequence=2)
+        self.assertEqual(packet[0], 8)
+        self.assertEqual(struct.unpack("!HH", packet[4:8]), (0x1234, 2))
+        # the checksum of a packet with a valid checksum is zero
+        self.assertEqual(get_checksum(packet), 0)
+        self.assertEqual(get_checksum(build_echo_request(1, 0, payload=b"odd")), 0)
+
+    def test_parse_echo_reply_after_ip_header(self):
+        reply = bytes([ICMP_ECHO_REPLY]) + build_echo_request(identifier=0x1234, sequence=2)[1:]
+        ip_header = bytes([0x46]) + bytes(23)
+        self.assertEqual(parse_echo_reply(ip_header + reply), (0x1234, 2))
+        self.assertIsNone(parse_echo_reply(ip_header + build_echo_request(0x1234, 2)))
+        self.assertIsNone(parse_echo_reply(ip_header + reply[:4]))
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_probes_are_spread_at_rate(self):
+        with mock.patch("pacing.time.monotonic", return_value=100.0) as monotonic:
+            pacer = TokenBucket(rate=10)
+            self.assertEqual([pacer.reserve() for _ in range(3)], [0.0, 0.1, 0.2])
+            self.assertAlmostEqual(pacer.reserve(tokens=3), 0.5)
+
+            # a long idle period refills no more than the capacity
+            monotonic.return_value = 200.0
+            self.assertEqual(pacer.reserve(), 0.0)
+            self.assertAlmostEqual(pacer.reserve(), 0.1)
+
+
+class ProbePlannerTest(unittest.TestCase):
+
+    @mock.patch("probe_planner.random.randint", return_value=0)
+    def test_silent_addresses_are_backed_off(self, randint):
+        planner = ProbePlanner(gone_after=1, max_backoff=4)
+        live, silent = "10.0.0.2", "10.0.0.3"
+
+        self.assertEqual(planner.plan([live, silent]), ([], [live, silent]))
+        planner.record(probed_ips=[live, silent], live_ips=[live])
+
+        # the silent address waits two cycles
+        self.assertEqual(planner.plan([live, silent]), ([live], []))
+        planner.record(probed_ips=[live], live_ips=[])
+
+        # a single miss keeps a live host probed every cycle
+        self.assertEqual(planner.plan([live, silent]), ([live], [silent]))
+        planner.record(probed_ips=[live, silent], live_ips=[])
+
+        # gone hosts are backed off as well
+        self.assertEqual(planner.plan([live, silent]), ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -32,6 +32,9 @@ from telegram_listener.utils import (
 
 bot = telebot.TeleBot(token=TELEGRAM_API_TOKEN)
 app = Flask(__name__)
+# last device list per network and user with its ETag,
+# re-used when the collector answers that it has not changed
+network_devices_responses = {}
 
 @app.route("/update-network-status", methods=["POST"])
 def update_network_status():
@@ -142,8 +145,15 @@ def manage_network_devices(message: Union[Message, CallbackQuery], edit_mode=Fal
 
     data = {"network_ssid": network_ssid, "telegram_user_id": user_id}
     url = get_url(endpoint="manage-network-devices")
-    res: Response = send_data(url=url, data=data, headers=HEADERS, http_method="get")
-    res: dict = res.json()
+    etag, cached_res = network_devices_responses.get((network_ssid, user_id), (None, None))
+    headers = {**HEADERS, "If-None-Match": etag} if etag else HEADERS
+    res: Response = send_data(url=url, data=data, headers=headers, http_method="get")
+    if res.status_code == 304:
+        res: dict = cached_res
+    else:
+        etag = res.headers.get("ETag")
+        res: dict = res.json()
+        network_devices_responses[(network_ssid, user_id)] = (etag, res)
     print(f"response from {url}: {res}")
     devices = res.get("devices")
     message_id = res.get("telegram_msg_id")